@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of the /metrics instrumentation (see servers/metrics.py).
+
+Two measurements:
+- the recording calls one request makes in the load balancer and in the
+  hashing server, timed in a tight loop, compared with the time per request at
+  the measured throughput;
+- end-to-end throughput with metrics on and off (LB_METRICS / HASH_METRICS),
+  alternating the two settings over several rounds so that drift on the
+  machine affects both alike. The load balancer forwards to the stub upstream;
+  the hashing server answers difficulty 0 from its cache, the cheapest
+  request, where recording weighs the most.
+
+    python benchmarks/bench_metrics_overhead.py --requests 5000 --rounds 3
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import timeit
+
+import httpx
+
+from _harness import BENCH_DIR, SERVERS_DIR, free_port, run_load, start_process, stop_process
+
+sys.path.insert(0, SERVERS_DIR)
+from metrics import LATENCY_BUCKETS, MetricsSchema, WorkerMetrics, local_region  # noqa: E402
+
+
+def recording_cost_us():
+    """Time (us) of the recording calls one successful request makes in the LB and in the hashing server."""
+    schema = MetricsSchema()
+    counter = schema.counter("counter", "", "label", range(64))
+    gauge = schema.gauge("gauge", "")
+    histogram = schema.histogram("histogram", "", LATENCY_BUCKETS, "label", range(64))
+    metrics = WorkerMetrics(schema, local_region(schema))
+
+    def lb_request():
+        # record_attempt + record_response
+        metrics.inc(counter, 3)
+        metrics.observe(histogram, 0.004, 3)
+        metrics.inc(counter, 1)
+        metrics.observe(histogram, 0.005)
+
+    def server_request():
+        # admission and executor gauges, then record_metrics for a cache miss
+        for value in (1, 0, 1, 0):
+            metrics.set(gauge, value)
+        metrics.inc(counter, 0)
+        metrics.observe(histogram, 0.004)
+        metrics.inc(counter, 1)
+        metrics.observe(histogram, 0.0001)
+        metrics.observe(histogram, 0.003, 4)
+
+    number = 200_000
+    return {name: min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+            for name, fn in (("lb", lb_request), ("server", server_request))}
+
+
+async def configure(lb_url, upstream_port):
+    async with httpx.AsyncClient() as client:
+        r = await client.post(f"{lb_url}/admin/config", json={
+            "servers": [{"host": "127.0.0.1", "port": upstream_port, "weight": 1, "id": 1}],
+        })
+        r.raise_for_status()
+
+
+async def measure_lb(enabled, upstream_port, args):
+    lb_port = free_port()
+    lb = start_process(["load_balancer.py"], lb_port, cwd=SERVERS_DIR, env={
+        "LB_HOST": "127.0.0.1", "LB_PORT": str(lb_port), "LB_METRICS": "1" if enabled else "0",
+    })
+    lb_url = f"http://127.0.0.1:{lb_port}"
+    try:
+        await configure(lb_url, upstream_port)
+        url = f"{lb_url}/bytes/256"
+        await run_load(url, args.concurrency, args.concurrency)
+        return await run_load(url, args.requests, args.concurrency)
+    finally:
+        stop_process(lb)
+
+
+async def measure_server(enabled, args):
+    port = free_port()
+    server = start_process(["http_multi_core_server.py"], port, cwd=SERVERS_DIR, env={
+        "HASH_HOST": "127.0.0.1", "HASH_PORT": str(port), "HASH_CACHE": "1",
+        "HASH_METRICS": "1" if enabled else "0",
+    })
+    try:
+        url = f"http://127.0.0.1:{port}/hash"
+        body = {"difficulty": 0}
+        await run_load(url, args.concurrency, args.concurrency, method="POST", json_body=body)
+        return await run_load(url, args.requests, args.concurrency, method="POST", json_body=body)
+    finally:
+        stop_process(server)
+
+
+def report(name, runs, cost_us):
+    on = statistics.median(stats["throughput"] for stats in runs[True])
+    off = statistics.median(stats["throughput"] for stats in runs[False])
+    p99_on = statistics.median(stats["p99_ms"] for stats in runs[True])
+    p99_off = statistics.median(stats["p99_ms"] for stats in runs[False])
+    print(f"{name:<8}{off:>11.0f}{on:>11.0f}{(off - on) / off * 100:>9.2f}%"
+          f"{p99_off:>10.2f}{p99_on:>10.2f}{cost_us * off / 1e6 * 100:>12.3f}%")
+
+
+async def main(args):
+    cost = recording_cost_us()
+    print(f"recording per request: lb {cost['lb']:.3f} us, server {cost['server']:.3f} us")
+
+    upstream_port = free_port()
+    upstream = start_process(["stub_upstream.py", str(upstream_port)], upstream_port, cwd=BENCH_DIR)
+    lb_runs, server_runs = {True: [], False: []}, {True: [], False: []}
+    try:
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                lb_runs[enabled].append(await measure_lb(enabled, upstream_port, args))
+                server_runs[enabled].append(await measure_server(enabled, args))
+    finally:
+        stop_process(upstream)
+
+    # "cost" is the recording time as a share of the time per request at the measured throughput
+    print(f"{'':<8}{'off req/s':>11}{'on req/s':>11}{'drop':>10}{'p99 off':>10}{'p99 on':>10}{'cost':>13}")
+    report("lb", lb_runs, cost["lb"])
+    report("server", server_runs, cost["server"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Hashes per second per core of the proof-of-work solver, per difficulty.
+
+Runs the original one-hash-per-iteration loop and the batched solver used by
+http_multi_core_server on a single core, checks that both return the same
+nonce and hash, and reports throughput and speedup.
+
+    python benchmarks/bench_pow_solver.py --max-difficulty 5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "servers"))
+
+from pow_solver import solve, solve_reference  # noqa: E402
+
+
+def timed(fn, difficulty, min_time):
+    """Run fn repeatedly for at least min_time seconds; return (result, hashes/s)."""
+    runs, elapsed = 0, 0.0
+    while elapsed < min_time or runs == 0:
+        start = time.perf_counter()
+        result = fn(difficulty)
+        elapsed += time.perf_counter() - start
+        runs += 1
+    hashes = (result[0] + 1) * runs
+    return result, hashes / elapsed
+
+
+def main(args):
+    print(f"{'difficulty':>10}{'nonce':>10}{'reference H/s':>16}{'batched H/s':>14}{'speedup':>9}")
+    for difficulty in range(1, args.max_difficulty + 1):
+        expected, reference_rate = timed(solve_reference, difficulty, args.min_time)
+        result, batched_rate = timed(solve, difficulty, args.min_time)
+        if result != expected:
+            raise SystemExit(f"mismatch at difficulty {difficulty}: {result} != {expected}")
+        print(f"{difficulty:>10}{result[0]:>10}{reference_rate:>16,.0f}"
+              f"{batched_rate:>14,.0f}{batched_rate / reference_rate:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-difficulty", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to measure each engine")
+    main(parser.parse_args())
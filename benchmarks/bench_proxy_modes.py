@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compare the load balancer's "json" and "passthrough" proxy modes and the
+asyncio-streams fast path (servers/fast_proxy.py, "streams").
+
+Starts a stub upstream, the Sanic load balancer and the fast path locally,
+then for each body size and mode sends a fixed number of requests and
+reports throughput and latency percentiles.
+
+    python benchmarks/bench_proxy_modes.py --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from _harness import BENCH_DIR, SERVERS_DIR, free_port, run_load, start_process, stop_process
+
+BODY_SIZES = {"small": 256, "large": 1024 * 1024}
+# mode -> (script, proxy_mode sent to /admin/config)
+MODES = {
+    "json": ("load_balancer.py", "json"),
+    "passthrough": ("load_balancer.py", "passthrough"),
+    "streams": ("fast_proxy.py", "passthrough"),
+}
+
+
+async def configure(lb_url, upstream_port, mode):
+    async with httpx.AsyncClient() as client:
+        r = await client.post(f"{lb_url}/admin/config", json={
+            "servers": [{"host": "127.0.0.1", "port": upstream_port, "weight": 1, "id": 1}],
+            "proxy_mode": mode,
+        })
+        r.raise_for_status()
+
+
+async def main(args):
+    upstream_port = free_port()
+    upstream = start_process(["stub_upstream.py", str(upstream_port)], upstream_port, cwd=BENCH_DIR)
+    lbs, lb_urls = [], {}
+    try:
+        for script in sorted({script for script, _ in MODES.values()}):
+            lb_port = free_port()
+            lbs.append(start_process([script], lb_port, cwd=SERVERS_DIR, env={
+                "LB_HOST": "127.0.0.1", "LB_PORT": str(lb_port),
+            }))
+            lb_urls[script] = f"http://127.0.0.1:{lb_port}"
+
+        print(f"{'body':<8}{'mode':<13}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for label, size in BODY_SIZES.items():
+            total = args.requests if label == "small" else max(1, args.requests // 10)
+            for mode, (script, proxy_mode) in MODES.items():
+                lb_url = lb_urls[script]
+                await configure(lb_url, upstream_port, proxy_mode)
+                # warm up the upstream connection pools
+                await run_load(f"{lb_url}/bytes/{size}", args.concurrency, args.concurrency)
+                stats = await run_load(f"{lb_url}/bytes/{size}", total, args.concurrency)
+                print(f"{label:<8}{mode:<13}{stats['throughput']:>10.0f}"
+                      f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['errors']:>8}")
+    finally:
+        for lb in lbs:
+            stop_process(lb)
+        stop_process(upstream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare the execution topologies of http_multi_core_server.
+
+For each HASH_TOPOLOGY the server is started locally with the result cache
+disabled, and the script reports:
+- startup time until /health answers,
+- resident memory of the whole process tree (from /proc, Linux only),
+- /hash throughput and latency at a fixed difficulty.
+
+    python benchmarks/bench_topologies.py --difficulty 3 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from _harness import SERVERS_DIR, free_port, run_load, stop_process
+
+TOPOLOGIES = ("process", "thread", "inline")
+
+
+def process_tree(pid):
+    pids = [pid]
+    for child_pid in pids:
+        try:
+            for task in os.listdir(f"/proc/{child_pid}/task"):
+                with open(f"/proc/{child_pid}/task/{task}/children") as f:
+                    pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_rss_mb(pid):
+    total_kb = 0
+    for child_pid in process_tree(pid):
+        try:
+            with open(f"/proc/{child_pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+def start_server(topology, port):
+    env = dict(os.environ, HASH_TOPOLOGY=topology, HASH_CACHE="0",
+               HASH_HOST="127.0.0.1", HASH_PORT=str(port))
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "http_multi_core_server.py"], cwd=SERVERS_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=0.5).status_code == 200:
+                return proc, time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None or time.perf_counter() - started > 60:
+            proc.kill()
+            raise RuntimeError(f"server with topology {topology} did not start")
+        time.sleep(0.05)
+
+
+async def main(args):
+    concurrency = args.concurrency or 4 * os.cpu_count()
+    print(f"{'topology':<10}{'startup s':>10}{'rss MB':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for topology in TOPOLOGIES:
+        port = free_port()
+        proc, startup = start_server(topology, port)
+        try:
+            url = f"http://127.0.0.1:{port}/hash"
+            body = {"difficulty": args.difficulty}
+            await run_load(url, concurrency, concurrency, method="POST", json_body=body)
+            stats = await run_load(url, args.requests, concurrency, method="POST", json_body=body)
+            rss = tree_rss_mb(proc.pid)
+        finally:
+            stop_process(proc)
+        print(f"{topology:<10}{startup:>10.2f}{rss:>9.0f}{stats['throughput']:>9.0f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--difficulty", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=0, help="default: 4 x cores")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of weighted round-robin selection cost as weights grow.
+
+Compares the old list-expansion scheduler (a list with sum(weights) entries,
+rebuilt on every config update) with the smooth weighted round robin used by
+the load balancer. For each weight scale it reports the rebuild cost, the
+per-selection cost and the longest burst of consecutive picks of one backend.
+
+    python benchmarks/bench_wrr_selection.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "servers"))
+
+from load_balancer import WeightedRoundRobinStrategy  # noqa: E402
+
+WEIGHT_SCALES = [1, 8, 64, 512, 4096]
+SELECTIONS = 100_000
+
+
+class ListExpansionRoundRobin:
+    """The scheduler the load balancer used before smooth weighted round robin."""
+
+    def __init__(self, servers):
+        self.weighted_list = []
+        for srv in servers:
+            self.weighted_list.extend([srv] * srv["weight"])
+        self.index = 0
+
+    def select(self):
+        server = self.weighted_list[self.index]
+        self.index = (self.index + 1) % len(self.weighted_list)
+        return server
+
+
+def make_servers(scale):
+    # Same shape as set_load_balancer_config: one fixed 1-core server plus one scaled server
+    return [
+        {"host": "10.0.0.1", "port": 8080, "weight": scale, "id": 1},
+        {"host": "10.0.0.2", "port": 8080, "weight": 8 * scale, "id": 2},
+        {"host": "10.0.0.3", "port": 8080, "weight": 3 * scale, "id": 3},
+    ]
+
+
+def longest_burst(scheduler, picks):
+    longest = run = 0
+    previous = None
+    for _ in range(picks):
+        server_id = scheduler.select()["id"]
+        run = run + 1 if server_id == previous else 1
+        previous = server_id
+        longest = max(longest, run)
+    return longest
+
+
+def main():
+    print(f"{'scale':>6}{'impl':>8}{'rebuild us':>12}{'select ns':>11}{'burst':>7}")
+    for scale in WEIGHT_SCALES:
+        servers = make_servers(scale)
+        for label, cls in (("list", ListExpansionRoundRobin), ("smooth", WeightedRoundRobinStrategy)):
+            rebuild = min(timeit.repeat(lambda: cls(servers), number=10, repeat=3)) / 10
+            scheduler = cls(servers)
+            select = min(timeit.repeat(scheduler.select, number=SELECTIONS, repeat=3)) / SELECTIONS
+            burst = longest_burst(cls(servers), 12 * scale)
+            print(f"{scale:>6}{label:>8}{rebuild * 1e6:>12.1f}{select * 1e9:>11.0f}{burst:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Minimal keep-alive HTTP/1.1 upstream used by the benchmarks.
+
+Any request to /bytes/<n> is answered with a JSON object whose serialized
+body is roughly <n> bytes long, so proxy overhead can be measured without
+the proof-of-work cost of the real hashing server.
+"""
+import asyncio
+import json
+import os
+import sys
+
+_bodies = {}
+
+
+def body_for(size):
+    body = _bodies.get(size)
+    if body is None:
+        padding = max(0, size - len('{"data": ""}'))
+        body = _bodies[size] = json.dumps({"data": "x" * padding}).encode()
+    return body
+
+
+async def handle(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, _, header_block = head.partition(b"\r\n")
+            path = request_line.split(b" ")[1].decode()
+            length = 0
+            for line in header_block.split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+
+            try:
+                size = int(path.rsplit("/", 1)[-1])
+            except ValueError:
+                size = 64
+            body = body_for(size)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"content-type: application/json\r\n"
+                b"content-length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=9001):
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("STUB_PORT", 9001))
+    asyncio.run(serve(port=port))
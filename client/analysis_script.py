@@ -0,0 +1,93 @@
+"""
+Gera os resultados do experimento a partir dos logs em logs/.
+
+Para cada cenário rps{rps}-cores{cores}-alg{algorithm} calcula vazão, percentis
+de latência, divisão da carga entre servidores, taxas de erro e uso de CPU das
+VMs por janela de tempo, e monta as tabelas do planejamento fatorial
+RPS_LEVELS x CORE_LEVELS x ALGORITHMS. Escreve summary.csv (uma linha por
+cenário) e windows.csv (uma linha por cenário e janela) em --out.
+
+Com --traces (padrão glob dos arquivos de TRACE_LOG do load balancer e dos
+servidores) o resumo inclui também p50/p99 de cada etapa da requisição.
+"""
+import argparse
+import csv
+import glob
+import os
+from modules.analysis_module import find_scenarios, analyze_scenario, factorial_table, trace_breakdowns
+
+# Métricas mostradas como tabela fatorial no terminal
+TABLE_METRICS = ["throughput_rps", "latency_p50_ms", "latency_p99_ms", "latency_p99.9_ms",
+                 "error_rate", "cpu_vm1_pct", "cpu_vm2_pct"]
+
+def env_levels(name, cast=str):
+    value = os.getenv(name)
+    return [cast(v) for v in value.split(",")] if value else None
+
+def write_csv(path, rows, first_columns=()):
+    columns = list(first_columns)
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.4f}" if abs(value) < 1 else f"{value:.1f}"
+    return str(value)
+
+def print_table(metric, table, algorithms):
+    print(f"\n{metric}")
+    header = ["rps", "cores"] + algorithms
+    lines = [header] + [[format_value(line[column]) for column in header] for line in table]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    for line in lines:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-dir", default="logs")
+    parser.add_argument("--out", default="results")
+    parser.add_argument("--window", type=float, default=1.0, help="tamanho da janela de tempo em segundos")
+    parser.add_argument("--traces", help="glob dos arquivos de trace, ex.: 'traces/*.jsonl'")
+    args = parser.parse_args()
+
+    scenarios = find_scenarios(args.log_dir)
+    if not scenarios:
+        print(f"Nenhum cenário encontrado em {args.log_dir}")
+        return
+
+    os.makedirs(args.out, exist_ok=True)
+    # Junção com os traces em partições, para caber em memória em execuções longas
+    breakdowns = trace_breakdowns([scenario["path"] for scenario in scenarios],
+                                  sorted(glob.glob(args.traces)), args.out) if args.traces else {}
+
+    rows, window_rows = [], []
+    for scenario in scenarios:
+        print(f"Analisando {scenario['name']}...")
+        row, windows = analyze_scenario(scenario, args.log_dir, args.window)
+        if args.traces:
+            row["traced"], histograms = breakdowns[scenario["path"]]
+            for component, histogram in histograms.items():
+                summary = histogram.summary_ms()
+                row[f"{component}_p50"] = summary["p50_ms"]
+                row[f"{component}_p99"] = summary["p99_ms"]
+        rows.append(row)
+        window_rows += [{"scenario": scenario["name"], **window} for window in windows]
+
+    write_csv(os.path.join(args.out, "summary.csv"), rows)
+    write_csv(os.path.join(args.out, "windows.csv"), window_rows,
+              ["scenario", "window_start", "completed", "ok_rps", "mean_latency_ms"])
+
+    for metric in TABLE_METRICS:
+        table, algorithms = factorial_table(rows, metric, env_levels("RPS_LEVELS", int),
+                                            env_levels("CORE_LEVELS", int), env_levels("ALGORITHMS"))
+        print_table(metric, table, algorithms)
+    print(f"\nResultados em {args.out}/summary.csv e {args.out}/windows.csv")
+
+if __name__ == "__main__":
+    main()
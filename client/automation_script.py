@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import time
 import json
@@ -5,10 +6,18 @@ import httpx
 import os
 import multiprocessing
 import shutil
+import glob
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from modules.proxmox_vm_manager_module import ProxmoxVMManager
-from modules.proxmox_monitor_module import ProxmoxMonitor
+from modules.metrics_collector_module import MetricsCollector
+from modules.mock_proxmox_module import MockProxmoxAPI
 from modules.load_tester_module import LoadTester
+from modules.latency_histogram_module import TaggedHistograms
+from modules.result_log_module import merge_result_logs
+from modules.scenario_scheduler_module import (Checkpoint, plan_scenarios, count_reconfigurations,
+                                               wait_for_backends, wait_for_event)
+from modules.local_cluster_module import LocalCluster, LocalVMManager
 
 # Carregar variáveis do .env
 load_dotenv()
@@ -16,16 +25,35 @@ load_dotenv()
 PROXMOX_IP = os.getenv("PROXMOX_IP")
 PROXMOX_TOKEN = os.getenv("PROXMOX_TOKEN")
 NODE = os.getenv("NODE")
-VM_ID_1 = int(os.getenv("VM_ID_1"))  # Servidor 1 (Fixado com 1 núcleo)
-VM_ID_2 = int(os.getenv("VM_ID_2"))  # Servidor 2 (Irá variar o número de núcleos)
+VM_ID_1 = int(os.getenv("VM_ID_1", 1))  # Servidor 1 (Fixado com 1 núcleo)
+VM_ID_2 = int(os.getenv("VM_ID_2", 2))  # Servidor 2 (Irá variar o número de núcleos)
 VM_IP_1 = os.getenv("VM_IP_1")  # IP da VM 1 para checagem de serviço
 VM_IP_2 = os.getenv("VM_IP_2")  # IP da VM 2 para checagem de serviço
 LB_URL = os.getenv("LB_URL")
 SERVER_1_CORES = 1
 EXPERIMENT_DURATION = int(os.getenv("EXPERIMENT_DURATION", 30))
-MAX_RPS_PER_PROCESS = 10
+# Um processo com o gerador assíncrono sustenta alguns milhares de RPS
+MAX_RPS_PER_PROCESS = int(os.getenv("MAX_RPS_PER_PROCESS", 2000))
+ARRIVAL = os.getenv("ARRIVAL", "poisson")
+# Cenários concluídos, para retomar uma execução interrompida
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", "logs/checkpoint.json")
+# Tempos máximos (s) das checagens de prontidão que substituem esperas fixas
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 120))
+MONITOR_READY_TIMEOUT = float(os.getenv("MONITOR_READY_TIMEOUT", 15))
+# Intervalo (s) entre amostras de CPU/RAM das VMs e do nó
+MONITOR_INTERVAL = float(os.getenv("MONITOR_INTERVAL", 0.25))
+# Alvos da coleta de métricas, com o rótulo usado nos logs
+MONITOR_TARGETS = [
+    {"label": "vm1", "node": NODE, "vm_id": VM_ID_1},
+    {"label": "vm2", "node": NODE, "vm_id": VM_ID_2},
+    {"label": "node", "node": NODE},
+]
+# Coleta também o /metrics do load balancer e dos servidores junto com CPU/RAM
+SCRAPE_METRICS = os.getenv("SCRAPE_METRICS", "1") == "1"
 
 # Definição dos fatores
+# Algoritmos aceitos pelo load balancer: round_robin, balanced_round_robin,
+# least_outstanding, power_of_two, ewma e least_work (por trabalho estimado)
 RPS_LEVELS = list(map(int, os.getenv("RPS_LEVELS", "100,1000,10000").split(',')))
 CORE_LEVELS = list(map(int, os.getenv("CORE_LEVELS", "1,2,4,8").split(',')))
 ALGORITHMS = os.getenv("ALGORITHMS", "round_robin,balanced_round_robin").split(',')
@@ -37,96 +65,230 @@ def clear_logs():
         shutil.rmtree(log_dir)
     os.makedirs(log_dir, exist_ok=True)
 
-def start_monitoring(vm_id, log_file, duration):
-    """Inicia o monitoramento em um processo separado."""
-    monitor = ProxmoxMonitor(PROXMOX_IP, PROXMOX_TOKEN, NODE, vm_id, log_file)
-    monitor.monitor(interval=1, duration=duration + 4)
-
 def merge_logs(scenario_name):
-    """Une os logs dos processos ao final do cenário."""
-    log_proc0 = f"logs/{scenario_name}-proc0-requests.txt"
-    for i in range(1, 10):  # Merge dos arquivos proc1, proc2 e proc3 no proc0
-        log_procN = f"logs/{scenario_name}-proc{i}-requests.txt"
-        if os.path.exists(log_procN):
-            with open(log_procN, "r") as f_in, open(log_proc0, "a") as f_out:
-                f_out.write(f_in.read())
-            os.remove(log_procN)
+    """
+    Une os logs binários de todos os processos do cenário em
+    logs/{scenario_name}-requests.bin, copiando em blocos.
+    """
+    proc_logs = sorted(glob.glob(f"logs/{scenario_name}-proc*-requests.bin"))
+    if not proc_logs:
+        return 0
+    total = merge_result_logs(proc_logs, f"logs/{scenario_name}-requests.bin", remove=True)
+    print(f"  {total} requisições registradas por {len(proc_logs)} processo(s)")
+    return total
+
+def merge_histograms(scenario_name):
+    """
+    Soma os histogramas de latência dos processos sem perda e mostra os
+    percentis do cenário, no total e por servidor.
+    """
+    merged = None
+    for path in sorted(glob.glob(f"logs/{scenario_name}-proc*-requests-histograms.json")):
+        histograms = TaggedHistograms.load(path)
+        merged = histograms if merged is None else merged.merge(histograms)
+        os.remove(path)
+    if merged is None:
+        return None
+
+    merged.save(f"logs/{scenario_name}-histograms.json")
+    groups = [("total", merged.combined())]
+    groups += [(f"servidor {server}", merged.combined(server=server)) for server in merged.tag_values("server")]
+    for name, histogram in groups:
+        summary = histogram.summary_ms()
+        print(f"  {name}: {summary['count']} req, p50 {summary['p50_ms']:.1f} ms, "
+              f"p99 {summary['p99_ms']:.1f} ms, p99.9 {summary['p99.9_ms']:.1f} ms, max {summary['max_ms']:.1f} ms")
+    return merged
 
 def run_load_test_process(process_num, base_url, rps, duration, scenario_name):
     """Executa o teste de carga em um processo separado."""
-    log_request_file = f"logs/{scenario_name}-proc{process_num}-requests.txt"
-    tester = LoadTester(base_url=base_url, duration=duration, log_file=log_request_file)
+    log_request_file = f"logs/{scenario_name}-proc{process_num}-requests.bin"
+    tester = LoadTester(base_url=base_url, duration=duration, log_file=log_request_file,
+                        max_rps=rps, arrival=ARRIVAL)
     tester.run()
 
-async def set_load_balancer_config(algorithm, cores_server2):
-    """Atualiza a configuração do Load Balancer"""
-    servers_config = [
-        {"host": "192.168.1.2", "port": 8080, "weight": SERVER_1_CORES, "id": 1},
-        {"host": "192.168.2.2", "port": 8080, "weight": cores_server2, "id": 2}
+class ProxmoxBackend:
+    """VMs reais do Proxmox."""
+
+    def __init__(self):
+        self.lb_url = LB_URL
+        self.vm_manager = ProxmoxVMManager(PROXMOX_IP, PROXMOX_TOKEN, NODE, VM_ID_2, VM_IP_2)
+        self.servers = {VM_ID_1: ("192.168.1.2", 8080), VM_ID_2: ("192.168.2.2", 8080)}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def collector(self, log_file):
+        return MetricsCollector(PROXMOX_IP, PROXMOX_TOKEN, MONITOR_TARGETS + scrape_targets(self),
+                                log_file, MONITOR_INTERVAL)
+
+class DryRunBackend:
+    """Servidores e load balancer locais (LocalCluster) no lugar das VMs."""
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.lb_url = cluster.lb_url
+        self.vm_manager = LocalVMManager(cluster, 2)
+        self.servers = {VM_ID_1: cluster.server_address(1), VM_ID_2: cluster.server_address(2)}
+        # API do Proxmox simulada, reportando CPU/RAM dos processos locais
+        self.proxmox = MockProxmoxAPI(PROXMOX_TOKEN, self.local_process)
+        self.proxmox_url = None
+
+    def local_process(self, vm_id):
+        local_id = {VM_ID_1: 1, VM_ID_2: 2}.get(vm_id)
+        if local_id is None or local_id not in self.cluster.processes:
+            return None
+        return self.cluster.pid(local_id), self.cluster.effective_cores(local_id)
+
+    async def start(self):
+        self.proxmox_url = await self.proxmox.start()
+
+    async def stop(self):
+        await self.proxmox.stop()
+
+    def collector(self, log_file):
+        return MetricsCollector(None, PROXMOX_TOKEN, MONITOR_TARGETS + scrape_targets(self),
+                                log_file, MONITOR_INTERVAL, base_url=self.proxmox_url)
+
+def scrape_targets(backend):
+    """Alvos /metrics do load balancer e dos servidores, se SCRAPE_METRICS estiver ativo."""
+    if not SCRAPE_METRICS:
+        return []
+    targets = [{"label": "lb-metrics", "url": f"{backend.lb_url.rstrip('/')}/metrics"}]
+    for server, vm_id in ((1, VM_ID_1), (2, VM_ID_2)):
+        host, port = backend.servers[vm_id]
+        targets.append({"label": f"server{server}-metrics", "url": f"http://{host}:{port}/metrics"})
+    return targets
+
+def backend_servers(backend, cores_server2):
+    """Configuração de servidores enviada ao load balancer."""
+    (host_1, port_1), (host_2, port_2) = backend.servers[VM_ID_1], backend.servers[VM_ID_2]
+    return [
+        {"host": host_1, "port": port_1, "weight": SERVER_1_CORES, "id": 1},
+        {"host": host_2, "port": port_2, "weight": cores_server2, "id": 2}
     ]
 
+async def set_load_balancer_config(lb_url, servers_config, algorithm):
+    """Atualiza a configuração do Load Balancer"""
+
     if algorithm == "round_robin":
         servers_config = [{"host": s["host"], "port": s["port"], "weight": 1, "id": s["id"]} for s in servers_config]
     
     async with httpx.AsyncClient() as client:
-        response = await client.post(f"{LB_URL}/admin/config", json={"servers": servers_config})
+        response = await client.post(f"{lb_url}/admin/config", json={"servers": servers_config, "algorithm": algorithm})
         if response.status_code == 200:
             print(f"✔ Load Balancer atualizado com sucesso para {algorithm} com pesos {servers_config}")
-        else:
-            print(f"❌ Erro ao atualizar Load Balancer: {response.status_code} - {response.text}")
+            return True
+        print(f"❌ Erro ao atualizar Load Balancer: {response.status_code} - {response.text}")
+        return False
 
 
-async def run_experiment():
-    clear_logs()
-    previous_cores = None
-    vm_manager = ProxmoxVMManager(PROXMOX_IP, PROXMOX_TOKEN, NODE, VM_ID_2, VM_IP_2)
-    
-    for cores in CORE_LEVELS:
-        if previous_cores != cores:
-            print(f"Alterando núcleos do servidor 2 para {cores}...")
-            vm_manager.update_vm_cores(cores)
-            previous_cores = cores
-
-            await asyncio.sleep(5)
-
-        for rps in RPS_LEVELS:
-            for algorithm in ALGORITHMS:
-                scenario_name = f"rps{rps}-cores{cores}-alg{algorithm}"
-                log_monitor_file_1 = f"logs/{scenario_name}-vm1-monitoring.txt"
-                log_monitor_file_2 = f"logs/{scenario_name}-vm2-monitoring.txt"
-
-                await set_load_balancer_config(algorithm, cores)
-                
-                print(f"\n=== Executando cenário: {scenario_name} ===")
-
-                # Iniciar monitoramento em processos separados
-                monitor_process_1 = multiprocessing.Process(target=start_monitoring, args=(VM_ID_1, log_monitor_file_1, EXPERIMENT_DURATION+5))
-                monitor_process_2 = multiprocessing.Process(target=start_monitoring, args=(VM_ID_2, log_monitor_file_2, EXPERIMENT_DURATION+5))
-                monitor_process_1.start()
-                monitor_process_2.start()
-                
-                await asyncio.sleep(2)  # Aguarda um tempo antes de iniciar as requisições
-
-                # Iniciar Teste de Carga com múltiplos processos
-                num_processes = max(1, rps // MAX_RPS_PER_PROCESS)
-                processes = []
-
-                for i in range(num_processes):
-                    process_rps = min(MAX_RPS_PER_PROCESS, rps - (i * MAX_RPS_PER_PROCESS))
-                    p = multiprocessing.Process(target=run_load_test_process, args=(i, LB_URL, process_rps, EXPERIMENT_DURATION, scenario_name))
-                    processes.append(p)
-                    p.start()
-                
-                for p in processes:
-                    p.join()
-                
-                # Unificar logs dos processos ao final do cenário
-                merge_logs(scenario_name)
-
-                # Esperar monitoramento terminar
-                monitor_process_1.join()
-                monitor_process_2.join()
-                print(f"Cenário {scenario_name} concluído!\n")
+def remove_scenario_logs(scenario_name):
+    """Apaga arquivos de uma execução anterior e incompleta do cenário."""
+    for path in glob.glob(f"logs/{scenario_name}-*"):
+        os.remove(path)
+
+def finish_scenario(checkpoint, scenario_name):
+    """Consolida os logs do cenário e só então o registra como concluído."""
+    requests = merge_logs(scenario_name)
+    merge_histograms(scenario_name)
+    checkpoint.mark_done(scenario_name, requests=requests)
+    print(f"Cenário {scenario_name} concluído!\n")
+
+async def run_scenario(backend, scenario):
+    scenario_name, rps = scenario["name"], scenario["rps"]
+    remove_scenario_logs(scenario_name)
+
+    if not await set_load_balancer_config(backend.lb_url, backend_servers(backend, scenario["cores"]), scenario["algorithm"]):
+        return False
+    await wait_for_backends(backend.lb_url, (1, 2), READY_TIMEOUT)
+
+    print(f"\n=== Executando cenário: {scenario_name} ===")
+
+    # Coleta de métricas de todas as VMs e do nó numa tarefa deste loop; o
+    # teste de carga só começa depois da primeira amostra
+    collector = backend.collector(f"logs/{scenario_name}-monitoring.jsonl")
+    collector_task = asyncio.create_task(collector.run())
+    await wait_for_event(collector.first_sample, MONITOR_READY_TIMEOUT)
+
+    # Iniciar Teste de Carga com múltiplos processos
+    num_processes = max(1, -(-rps // MAX_RPS_PER_PROCESS))
+    processes = []
+
+    for i in range(num_processes):
+        process_rps = min(MAX_RPS_PER_PROCESS, rps - (i * MAX_RPS_PER_PROCESS))
+        p = multiprocessing.Process(target=run_load_test_process, args=(i, backend.lb_url, process_rps, EXPERIMENT_DURATION, scenario_name))
+        processes.append(p)
+        p.start()
+
+    loop = asyncio.get_running_loop()
+    for p in processes:
+        await loop.run_in_executor(None, p.join)
+
+    # Mais algumas amostras depois da carga, como antes, e encerra a coleta
+    await asyncio.sleep(4)
+    collector.stop()
+    await collector_task
+    print(f"  Métricas: {collector.stats()}")
+    return all(p.exitcode == 0 for p in processes)
+
+async def run_experiment(backend, fresh=False):
+    if fresh or not os.path.exists(CHECKPOINT_FILE):
+        clear_logs()
+    await backend.start()
+    try:
+        await run_pending_scenarios(backend)
+    finally:
+        await backend.stop()
+
+async def run_pending_scenarios(backend):
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    vm_manager = backend.vm_manager
+
+    current_cores = vm_manager.get_cpu_cores()
+    plan = plan_scenarios(CORE_LEVELS, RPS_LEVELS, ALGORITHMS, current_cores)
+    pending = checkpoint.pending(plan)
+    print(f"{len(plan) - len(pending)} de {len(plan)} cenários já concluídos; "
+          f"{count_reconfigurations(pending, current_cores)} reconfiguração(ões) de VM previstas.")
+
+    # A consolidação dos logs de um cenário roda em paralelo com o próximo
+    with ThreadPoolExecutor(max_workers=1) as finisher:
+        finishing = None
+        for scenario in pending:
+            cores = scenario["cores"]
+            if current_cores != cores:
+                print(f"Alterando núcleos do servidor 2 para {cores}...")
+                if not vm_manager.update_vm_cores(cores):
+                    print(f"❌ Não foi possível configurar {cores} núcleos; interrompendo. Execute novamente para retomar.")
+                    break
+                current_cores = cores
+
+            ok = await run_scenario(backend, scenario)
+            if finishing is not None:
+                finishing.result()
+            if not ok:
+                print(f"❌ Cenário {scenario['name']} falhou; ele será repetido na próxima execução.")
+                finishing = None
+                continue
+            finishing = finisher.submit(finish_scenario, checkpoint, scenario["name"])
+        if finishing is not None:
+            finishing.result()
+
+def main():
+    parser = argparse.ArgumentParser(description="Executa os cenários do experimento, retomando do último checkpoint.")
+    parser.add_argument("--fresh", action="store_true", help="apaga logs e checkpoint e começa do zero")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="usa servidores e load balancer locais, com núcleos limitados por afinidade de CPU, "
+                             "em vez do Proxmox")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        with LocalCluster() as cluster:
+            asyncio.run(run_experiment(DryRunBackend(cluster), args.fresh))
+    else:
+        asyncio.run(run_experiment(ProxmoxBackend(), args.fresh))
 
 if __name__ == "__main__":
-    asyncio.run(run_experiment())
+    main()
@@ -0,0 +1,364 @@
+import datetime
+import glob
+import json
+import math
+import os
+import re
+import tempfile
+import numpy as np
+from modules.latency_histogram_module import LatencyHistogram
+from modules.result_log_module import load_result_log, ERROR_TIMEOUT, ERROR_CONNECT, ERROR_OTHER
+
+SCENARIO_PATTERN = re.compile(r"rps(?P<rps>\d+)-cores(?P<cores>\d+)-alg(?P<algorithm>.+)-requests\.bin$")
+MONITOR_PATTERN = re.compile(
+    r"^(?P<time>\S+ \S+) - CPU: (?P<cpu>[-\d.eE]+) \| RAM: (?P<ram>[-\d.eE]+)%"
+)
+# Registros processados por vez; limita a memória independentemente do tamanho do log
+CHUNK_RECORDS = 1_000_000
+VMS = ("vm1", "vm2")
+# Mesmo modelo de custo do load balancer: trabalho esperado = COST_BASE ** dificuldade
+COST_BASE = float(os.getenv("COST_BASE", 16))
+
+def find_scenarios(log_dir="logs"):
+    """Cenários com log de requisições em log_dir, ordenados por (rps, cores, algoritmo)."""
+    scenarios = []
+    for path in glob.glob(os.path.join(log_dir, "*-requests.bin")):
+        match = SCENARIO_PATTERN.search(os.path.basename(path))
+        if match is None or "-proc" in match.group("algorithm"):
+            continue
+        scenarios.append({
+            "name": os.path.basename(path)[:-len("-requests.bin")],
+            "rps": int(match.group("rps")),
+            "cores": int(match.group("cores")),
+            "algorithm": match.group("algorithm"),
+            "path": path,
+        })
+    return sorted(scenarios, key=lambda s: (s["rps"], s["cores"], s["algorithm"]))
+
+def record_many(histogram, values_us):
+    """Versão vetorizada de LatencyHistogram.record para um array de valores."""
+    values = np.asarray(values_us, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return histogram
+    values = np.maximum(values, 0).astype(np.int64)
+    clamped = values > histogram.highest_value_us
+    values[clamped] = histogram.highest_value_us
+
+    # Mesmo cálculo de LatencyHistogram.index_for, com bit_length via log2
+    bits = np.floor(np.log2(values | histogram.sub_bucket_mask)).astype(np.int64) + 1
+    bucket_index = bits - 1 - histogram.sub_bucket_half_count_magnitude
+    sub_bucket_index = values >> bucket_index
+    indices = ((bucket_index + 1) << histogram.sub_bucket_half_count_magnitude) + (
+        sub_bucket_index - histogram.sub_bucket_half_count
+    )
+    counts = np.frombuffer(histogram.counts, dtype=np.uint64)
+    counts += np.bincount(indices, minlength=counts.size).astype(np.uint64)
+
+    histogram.total += int(values.size)
+    histogram.clamped += int(clamped.sum())
+    low, high = int(values.min()), int(values.max())
+    histogram.min_us = low if histogram.min_us is None else min(histogram.min_us, low)
+    histogram.max_us = max(histogram.max_us, high)
+    return histogram
+
+class WindowAccumulator:
+    """Somas por janela de tempo absoluta (floor(t / window)), acumuladas entre blocos."""
+
+    def __init__(self):
+        self.columns = {}
+
+    def add(self, windows, **weights):
+        if not windows.size:
+            return
+        keys, inverse = np.unique(windows, return_inverse=True)
+        for name, values in weights.items():
+            sums = np.bincount(inverse, weights=values, minlength=keys.size)
+            column = self.columns.setdefault(name, {})
+            for key, value in zip(keys.tolist(), sums.tolist()):
+                column[key] = column.get(key, 0.0) + value
+
+    def windows(self):
+        return sorted(set().union(*(column.keys() for column in self.columns.values())))
+
+    def get(self, name, window):
+        return self.columns.get(name, {}).get(window, 0.0)
+
+def analyze_requests(path, window=1.0, chunk_records=CHUNK_RECORDS):
+    """
+    Agrega o log binário de um cenário em blocos de chunk_records registros.
+
+    :return: dict com contagens, histogramas de latência (total e por servidor),
+             carga por servidor e um WindowAccumulator por janela de tempo
+    """
+    data = load_result_log(path)
+    overall = LatencyHistogram()
+    per_server = {}
+    server_counts = {}
+    server_work = {}
+    windows = WindowAccumulator()
+    counts = {"requests": 0, "ok": 0, "http_errors": 0, "shed": 0,
+              "timeouts": 0, "connect_errors": 0, "other_errors": 0}
+    first_scheduled, last_received = np.inf, -np.inf
+
+    for start in range(0, len(data), chunk_records):
+        chunk = data[start:start + chunk_records]
+        status = np.asarray(chunk["status"])
+        error = np.asarray(chunk["error"])
+        scheduled = np.asarray(chunk["request_scheduled"])
+        received = np.asarray(chunk["request_received"])
+        latency_us = np.asarray(chunk["latency"]) * 1000
+        ok = status == 200
+        # Dificuldade como o load balancer a normaliza (arredondada, mínimo 0)
+        work = COST_BASE ** np.clip(np.rint(np.asarray(chunk["difficulty"])), 0, None)
+
+        counts["requests"] += int(status.size)
+        counts["ok"] += int(ok.sum())
+        counts["http_errors"] += int(((status != 200) & (status != 0)).sum())
+        counts["shed"] += int((status == 503).sum())
+        counts["timeouts"] += int((error == ERROR_TIMEOUT).sum())
+        counts["connect_errors"] += int((error == ERROR_CONNECT).sum())
+        counts["other_errors"] += int((error == ERROR_OTHER).sum())
+        first_scheduled = min(first_scheduled, float(scheduled.min()))
+        last_received = max(last_received, float(received.max()))
+
+        record_many(overall, latency_us[ok])
+        servers, inverse = np.unique(np.asarray(chunk["server"])[ok], return_inverse=True)
+        ok_latency = latency_us[ok]
+        ok_work = work[ok]
+        for i, server in enumerate(servers.tolist()):
+            name = server.decode() or "?"
+            selected = inverse == i
+            server_counts[name] = server_counts.get(name, 0) + int(selected.sum())
+            server_work[name] = server_work.get(name, 0.0) + float(ok_work[selected].sum())
+            record_many(per_server.setdefault(name, LatencyHistogram()), ok_latency[selected])
+
+        # Janelas pelo instante de conclusão, alinhadas ao relógio de parede
+        window_index = np.floor(received / window).astype(np.int64)
+        windows.add(window_index,
+                    completed=np.ones(status.size),
+                    ok=ok.astype(np.float64),
+                    latency_sum=np.where(ok, latency_us / 1000, 0.0))
+
+    return {
+        "counts": counts,
+        "latency": overall,
+        "server_latency": per_server,
+        "server_counts": server_counts,
+        "server_work": server_work,
+        "windows": windows,
+        "start": first_scheduled if counts["requests"] else None,
+        "end": last_received if counts["requests"] else None,
+    }
+
+def load_monitoring(log_dir, name):
+    """
+    Lê as amostras de CPU/RAM de um cenário: o JSON lines do MetricsCollector
+    ou, para execuções antigas, os logs de texto do ProxmoxMonitor por VM.
+
+    :return: {rótulo: (timestamps em segundos desde a época, cpu em %, ram em %)}
+    """
+    path = os.path.join(log_dir, f"{name}-monitoring.jsonl")
+    if not os.path.exists(path):
+        return {vm: load_monitor_log(os.path.join(log_dir, f"{name}-{vm}-monitoring.txt")) for vm in VMS}
+    samples = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            # Amostras com erro e coletas de /metrics não têm CPU/RAM
+            if "cpu_pct" not in record:
+                continue
+            times, cpu, ram = samples.setdefault(record["label"], ([], [], []))
+            times.append(record["time"])
+            cpu.append(record["cpu_pct"])
+            ram.append(record["mem_pct"])
+    return {label: tuple(np.array(column) for column in columns) for label, columns in samples.items()}
+
+def load_monitor_log(path):
+    """
+    Lê o log de texto do ProxmoxMonitor.
+
+    :return: (timestamps em segundos desde a época, cpu em %, ram em %) como arrays
+    """
+    if not os.path.exists(path):
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    times, cpu, ram = [], [], []
+    with open(path) as f:
+        for line in f:
+            match = MONITOR_PATTERN.match(line)
+            if match is None:
+                continue
+            times.append(datetime.datetime.fromisoformat(match.group("time")).timestamp())
+            cpu.append(float(match.group("cpu")))
+            ram.append(float(match.group("ram")))
+    # A API do Proxmox informa a CPU como fração dos núcleos alocados à VM
+    return np.array(times), np.array(cpu) * 100, np.array(ram)
+
+def analyze_scenario(scenario, log_dir="logs", window=1.0):
+    requests = analyze_requests(scenario["path"], window)
+    counts = requests["counts"]
+    start, end = requests["start"], requests["end"]
+    elapsed = (end - start) if start is not None else 0
+    latency = requests["latency"].summary_ms()
+
+    row = {
+        "scenario": scenario["name"],
+        "rps": scenario["rps"],
+        "cores": scenario["cores"],
+        "algorithm": scenario["algorithm"],
+        **counts,
+        "throughput_rps": counts["ok"] / elapsed if elapsed > 0 else 0,
+        "error_rate": (counts["requests"] - counts["ok"]) / counts["requests"] if counts["requests"] else 0,
+        **{f"latency_{key}": value for key, value in latency.items() if key.endswith("_ms")},
+    }
+    total_work = sum(requests["server_work"].values())
+    for server, count in sorted(requests["server_counts"].items()):
+        row[f"share_{server}"] = count / counts["ok"] if counts["ok"] else 0
+        row[f"work_share_{server}"] = requests["server_work"][server] / total_work if total_work else 0
+        row[f"p99_ms_{server}"] = requests["server_latency"][server].summary_ms()["p99_ms"]
+
+    # CPU média de cada VM só nas janelas em que o cenário estava ativo
+    window_rows = {w: {"window_start": w * window} for w in requests["windows"].windows()}
+    for name, w_row in window_rows.items():
+        completed = requests["windows"].get("completed", name)
+        ok = requests["windows"].get("ok", name)
+        w_row["completed"] = int(completed)
+        w_row["ok_rps"] = ok / window
+        w_row["mean_latency_ms"] = requests["windows"].get("latency_sum", name) / ok if ok else 0
+    for vm, (times, cpu, _) in sorted(load_monitoring(log_dir, scenario["name"]).items()):
+        active = (times >= start) & (times <= end) if start is not None else np.zeros(times.size, bool)
+        row[f"cpu_{vm}_pct"] = float(cpu[active].mean()) if active.any() else None
+        if times.size:
+            vm_windows = WindowAccumulator()
+            vm_windows.add(np.floor(times / window).astype(np.int64), cpu=cpu, samples=np.ones(times.size))
+            for w, w_row in window_rows.items():
+                samples = vm_windows.get("samples", w)
+                w_row[f"cpu_{vm}_pct"] = vm_windows.get("cpu", w) / samples if samples else None
+    return row, [window_rows[w] for w in sorted(window_rows)]
+
+# Componentes da latência reconstruídos a partir dos traces (ms)
+TRACE_COMPONENTS = [
+    "lb.lb_queue_ms", "lb.lb_select_ms", "lb.upstream_wait_ms", "lb.upstream_connect_ms",
+    "server.queue_ms", "server.compute_ms", "server.app_ms", "lb_to_server_ms", "client_to_lb_ms",
+]
+
+def load_traces(paths):
+    """
+    Junta os registros de trace do load balancer e do servidor (ver
+    servers/trace_sink.py) por trace_id: {trace_id: {"lb.campo": ..., "server.campo": ...}}.
+    Carrega tudo em memória; para execuções longas use trace_breakdowns, que
+    chama esta função para uma partição por vez.
+    """
+    traces = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                hop = record.pop("hop")
+                entry = traces.setdefault(int(record.pop("trace_id"), 16), {})
+                for key, value in record.items():
+                    entry[f"{hop}.{key}"] = value
+    return traces
+
+def partition_traces(paths, directory, records_per_partition=CHUNK_RECORDS):
+    """
+    Distribui os registros de trace em N arquivos em directory por
+    trace_id % N, com N escolhido para que cada partição tenha cerca de
+    records_per_partition registros e caiba em memória na junção.
+
+    :return: caminhos das partições, na ordem do resto trace_id % N
+    """
+    total = 0
+    for path in paths:
+        with open(path) as f:
+            total += sum(1 for _ in f)
+    count = max(1, math.ceil(total / records_per_partition))
+    partitions = [os.path.join(directory, f"traces-{i}.jsonl") for i in range(count)]
+    files = [open(partition, "w") for partition in partitions]
+    try:
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    trace_id = int(json.loads(line)["trace_id"], 16)
+                    files[trace_id % count].write(line if line.endswith("\n") else line + "\n")
+    finally:
+        for f in files:
+            f.close()
+    return partitions
+
+def trace_breakdown(path, traces, histograms=None, partition=(0, 1), chunk_records=CHUNK_RECORDS):
+    """
+    Percentis de cada componente da latência para as requisições do log que
+    têm trace. Além dos tempos medidos em cada salto, calcula por diferença o
+    tempo entre cliente e load balancer (latência sem o total do LB, o que
+    inclui rede e espera do lado do cliente) e entre LB e servidor (upstream
+    sem o tempo da aplicação).
+
+    :param histograms: histogramas a acumular (novos se None)
+    :param partition: (índice, N): considera só as requisições com
+                      trace_id % N == índice, as que estão em "traces"
+    :return: (requisições com trace, histogramas por componente)
+    """
+    if histograms is None:
+        histograms = {component: LatencyHistogram() for component in TRACE_COMPONENTS}
+    index, count = partition
+    data = load_result_log(path)
+    matched = 0
+    for start in range(0, len(data), chunk_records):
+        chunk = data[start:start + chunk_records]
+        trace_ids = np.asarray(chunk["trace_id"])
+        selected = trace_ids % count == index
+        latencies = np.asarray(chunk["latency"])[selected]
+        for trace_id, latency in zip(trace_ids[selected].tolist(), latencies.tolist()):
+            entry = traces.get(trace_id)
+            if entry is None or "lb.total_ms" not in entry:
+                continue
+            matched += 1
+            values = {component: entry.get(component) for component in TRACE_COMPONENTS}
+            values["client_to_lb_ms"] = latency - entry["lb.total_ms"]
+            if "server.app_ms" in entry:
+                values["lb_to_server_ms"] = entry["lb.upstream_ms"] - entry["server.app_ms"]
+            for component, value in values.items():
+                if value is not None:
+                    histograms[component].record(max(0.0, value) * 1000)
+    return matched, histograms
+
+def trace_breakdowns(log_paths, trace_paths, work_dir=None, records_per_partition=CHUNK_RECORDS):
+    """
+    trace_breakdown de vários logs de requisições com memória limitada: os
+    traces são particionados por trace_id em arquivos temporários em work_dir
+    (partition_traces) e cada partição é carregada e juntada com todos os
+    logs antes da próxima.
+
+    :return: {caminho do log: (requisições com trace, histogramas por componente)}
+    """
+    results = {path: (0, {component: LatencyHistogram() for component in TRACE_COMPONENTS})
+               for path in log_paths}
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        partitions = partition_traces(trace_paths, directory, records_per_partition)
+        for index, partition in enumerate(partitions):
+            traces = load_traces([partition])
+            for path, (matched, histograms) in results.items():
+                found, _ = trace_breakdown(path, traces, histograms, (index, len(partitions)))
+                results[path] = (matched + found, histograms)
+            del traces
+    return results
+
+def factorial_table(rows, metric, rps_levels=None, core_levels=None, algorithms=None):
+    """
+    Tabela do planejamento fatorial: uma linha por (rps, cores), uma coluna por
+    algoritmo, com o valor de "metric" de cada cenário (None se não executado).
+    """
+    by_key = {(row["rps"], row["cores"], row["algorithm"]): row for row in rows}
+    rps_levels = rps_levels or sorted({row["rps"] for row in rows})
+    core_levels = core_levels or sorted({row["cores"] for row in rows})
+    algorithms = algorithms or sorted({row["algorithm"] for row in rows})
+    table = []
+    for rps in rps_levels:
+        for cores in core_levels:
+            line = {"rps": rps, "cores": cores}
+            for algorithm in algorithms:
+                row = by_key.get((rps, cores, algorithm))
+                line[algorithm] = row.get(metric) if row else None
+            table.append(line)
+    return table, algorithms
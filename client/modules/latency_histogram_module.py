@@ -0,0 +1,189 @@
+import json
+import math
+from array import array
+
+class LatencyHistogram:
+    """
+    Histograma de latências no estilo HDR, com memória fixa.
+
+    Os valores (em microssegundos) caem em baldes log-lineares: cada potência
+    de 2 é dividida em sub-baldes, o que garante erro relativo máximo de
+    10^-significant_digits em qualquer faixa. Dois histogramas com a mesma
+    configuração podem ser somados sem perda, contagem a contagem.
+    """
+
+    def __init__(self, highest_value_us=600_000_000, significant_digits=2):
+        """
+        :param highest_value_us: Maior valor registrável (valores acima são truncados nele)
+        :param significant_digits: Dígitos significativos preservados (1 a 5)
+        """
+        self.highest_value_us = highest_value_us
+        self.significant_digits = significant_digits
+        largest_single_unit = 2 * 10 ** significant_digits
+        self.sub_bucket_half_count_magnitude = max(0, math.ceil(math.log2(largest_single_unit)) - 1)
+        self.sub_bucket_count = 2 ** (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = self.sub_bucket_count - 1
+
+        bucket_count = 1
+        smallest_untrackable = self.sub_bucket_count
+        while smallest_untrackable <= highest_value_us:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+        self.counts = array("Q", [0]) * ((bucket_count + 1) * self.sub_bucket_half_count)
+        self.total = 0
+        self.clamped = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def config(self):
+        return {"highest_value_us": self.highest_value_us, "significant_digits": self.significant_digits}
+
+    def index_for(self, value):
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - 1 - self.sub_bucket_half_count_magnitude
+        sub_bucket_index = value >> bucket_index
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + (sub_bucket_index - self.sub_bucket_half_count)
+
+    def value_for(self, index):
+        """Maior valor equivalente ao balde de índice "index"."""
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        lowest = sub_bucket_index << bucket_index
+        return lowest + (1 << bucket_index) - 1
+
+    def record(self, value_us, count=1):
+        value = max(0, int(value_us))
+        if value > self.highest_value_us:
+            value = self.highest_value_us
+            self.clamped += count
+        self.counts[self.index_for(value)] += count
+        self.total += count
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def merge(self, other):
+        """Soma as contagens de outro histograma com a mesma configuração."""
+        if other.config() != self.config():
+            raise ValueError("Histogramas com configurações diferentes não podem ser somados")
+        counts = self.counts
+        for i, count in enumerate(other.counts):
+            if count:
+                counts[i] += count
+        self.total += other.total
+        self.clamped += other.clamped
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, p):
+        """Latência (µs) abaixo da qual estão p% das amostras."""
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.value_for(i), self.max_us)
+        return self.max_us
+
+    def mean(self):
+        if not self.total:
+            return 0
+        return sum(self.value_for(i) * c for i, c in enumerate(self.counts) if c) / self.total
+
+    def summary_ms(self):
+        return {
+            "count": self.total,
+            "min_ms": (self.min_us or 0) / 1000,
+            "mean_ms": self.mean() / 1000,
+            "p50_ms": self.percentile(50) / 1000,
+            "p90_ms": self.percentile(90) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "p99.9_ms": self.percentile(99.9) / 1000,
+            "max_ms": self.max_us / 1000,
+            "clamped": self.clamped,
+        }
+
+    def to_dict(self):
+        """Forma serializável e esparsa (só baldes não vazios)."""
+        return {
+            "config": self.config(),
+            "total": self.total,
+            "clamped": self.clamped,
+            "min_us": self.min_us,
+            "max_us": self.max_us,
+            "counts": [[i, c] for i, c in enumerate(self.counts) if c],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(**data["config"])
+        for i, c in data["counts"]:
+            histogram.counts[i] = c
+        histogram.total = data["total"]
+        histogram.clamped = data["clamped"]
+        histogram.min_us = data["min_us"]
+        histogram.max_us = data["max_us"]
+        return histogram
+
+class TaggedHistograms:
+    """Um LatencyHistogram por combinação de tags (status, servidor, dificuldade)."""
+
+    TAGS = ("status", "server", "difficulty")
+
+    def __init__(self, **config):
+        self.config = config
+        self.histograms = {}
+
+    def record(self, value_us, status, server, difficulty):
+        key = (str(status), str(server), str(difficulty))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram(**self.config)
+        histogram.record(value_us)
+
+    def merge(self, other):
+        for key, histogram in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key].merge(histogram)
+            else:
+                self.histograms[key] = LatencyHistogram.from_dict(histogram.to_dict())
+        return self
+
+    def combined(self, **filters):
+        """Histograma somando todas as tags que batem com os filtros (ex.: server="vm1")."""
+        result = LatencyHistogram(**self.config)
+        for key, histogram in self.histograms.items():
+            tags = dict(zip(self.TAGS, key))
+            if all(tags[name] == str(value) for name, value in filters.items()):
+                result.merge(histogram)
+        return result
+
+    def tag_values(self, tag):
+        position = self.TAGS.index(tag)
+        return sorted({key[position] for key in self.histograms})
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "config": self.config,
+                "histograms": [
+                    {"tags": dict(zip(self.TAGS, key)), **histogram.to_dict()}
+                    for key, histogram in self.histograms.items()
+                ],
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        tagged = cls(**data["config"])
+        for entry in data["histograms"]:
+            key = tuple(entry["tags"][name] for name in cls.TAGS)
+            tagged.histograms[key] = LatencyHistogram.from_dict(entry)
+        return tagged
@@ -1,83 +1,182 @@
+import asyncio
 import time
 import json
+import os
 import random
-import requests
-import threading
+import httpx
+from modules.latency_histogram_module import TaggedHistograms
+from modules.result_log_module import (ResultLogWriter, ERROR_NONE, ERROR_TIMEOUT,
+                                       ERROR_CONNECT, ERROR_OTHER)
+
+def error_code(exc):
+    """Classifica a falha de uma requisição para a coluna "error" do log."""
+    if isinstance(exc, httpx.TimeoutException):
+        return ERROR_TIMEOUT
+    if isinstance(exc, httpx.NetworkError):
+        return ERROR_CONNECT
+    return ERROR_OTHER
 
 class LoadTester:
-    def __init__(self, base_url, duration=10, log_file="load_test.log", max_rps=1):
+    def __init__(self, base_url, duration=10, log_file="load_test.bin", max_rps=1,
+                 arrival="poisson", max_connections=1000, timeout=5, seed=None):
         """
         :param base_url: URL do load balancer ou servidor alvo
         :param duration: Duração total do teste em segundos
-        :param log_file: Caminho do arquivo de log
-        :param max_rps: Limite máximo de requisições por segundo
+        :param log_file: Caminho do log binário de requisições (ver result_log_module)
+        :param max_rps: Taxa alvo de requisições por segundo
+        :param arrival: "poisson" (intervalos exponenciais) ou "constant" (intervalos fixos)
+        :param max_connections: Tamanho do pool de conexões keep-alive
+        :param timeout: Timeout de cada requisição em segundos
+        :param seed: Semente opcional para reproduzir a sequência de chegadas e dificuldades
         """
+        if arrival not in ("poisson", "constant"):
+            raise ValueError(f"arrival deve ser 'poisson' ou 'constant', não {arrival!r}")
         self.base_url = base_url.rstrip('/')
         self.duration = duration
         self.log_file = log_file
         self.max_rps = max_rps
-        self.results = []
-        self.stop_time = time.time() + self.duration
-        self.last_request_time = 0
-        self.lock = threading.Lock()
-
-    def send_request(self):
-        """Envia uma requisição ao servidor alvo e mede o tempo de resposta, respeitando o limite de RPS."""
-        while time.time() < self.stop_time:
-            with self.lock:
-                current_time = time.time()
-                elapsed_time = current_time - self.last_request_time
-                if elapsed_time < 0.9:
-                    time.sleep(0.99-elapsed_time)
-                self.last_request_time = time.time()
-            
-            request_start_time = time.time()
-            difficulty = random.gauss(3, 1.5)
-            
+        self.arrival = arrival
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        # Latências medidas a partir do instante planejado de envio, por
+        # (status, servidor, dificuldade); memória fixa independente da duração
+        self.histograms = TaggedHistograms()
+        self.requests_done = 0
+        # IDs de trace: 32 bits aleatórios por processo seguidos de um contador
+        self.trace_prefix = random.SystemRandom().getrandbits(32) << 32
+        self.trace_counter = 0
+        self.log = None
+        self.summary = {}
+
+    def next_interval(self):
+        """Intervalo até a próxima chegada, em segundos."""
+        if self.arrival == "poisson":
+            return self.random.expovariate(self.max_rps)
+        return 1 / self.max_rps
+
+    async def send_request(self, client, scheduled_time, scheduled_loop_time):
+        """
+        Envia uma requisição ao servidor alvo e mede o tempo de resposta.
+
+        A latência principal é contada a partir do instante planejado, e não do
+        envio efetivo, para não esconder atrasos do próprio cliente
+        (coordinated omission). "service_latency" é contada a partir do envio.
+        """
+        loop = asyncio.get_running_loop()
+        request_start_time = time.time()
+        sent_loop_time = loop.time()
+        difficulty = self.random.gauss(3, 1.5)
+        self.trace_counter += 1
+        trace_id = self.trace_prefix | self.trace_counter
+
+        try:
+            response = await client.post("/hash", json={"difficulty": difficulty},
+                                         headers={"X-Trace-Id": f"{trace_id:016x}"})
+            request_end_time = time.time()
+            end_loop_time = loop.time()
+            latency = (end_loop_time - scheduled_loop_time) * 1000  # Convertendo para ms
+            service_latency = (end_loop_time - sent_loop_time) * 1000
+
             try:
-                response = requests.post(f"{self.base_url}/hash", json={"difficulty": difficulty}, timeout=5)
-                request_end_time = time.time()
-                latency = (request_end_time - request_start_time) * 1000  # Convertendo para ms
-                
-                try:
-                    response_data = response.json()
-                except json.JSONDecodeError:
-                    response_data = {"error": "Invalid JSON response"}
-                
-                latency_on_server = (response_data.get("end_time", 0) - response_data.get("start_time", 0)) * 1000  # Convertendo para ms
-                
-                self.results.append({
-                    "request_sent": request_start_time,
-                    "request_received": request_end_time,
-                    "latency": latency,
-                    "latency_on_server": latency_on_server,
-                    "difficulty": difficulty,
-                    "status": response.status_code,
-                    "server": response_data.get("server")
-                })
-            except Exception as e:
-                self.results.append({"error": str(e)})
-    
+                response_data = response.json()
+            except json.JSONDecodeError:
+                response_data = {"error": "Invalid JSON response"}
+
+            latency_on_server = (response_data.get("end_time", 0) - response_data.get("start_time", 0)) * 1000  # Convertendo para ms
+            # O load balancer identifica o servidor no header X-Server-Id; o
+            # hostname do corpo só serve sem LB (e não distingue servidores no mesmo host)
+            status = response.status_code
+            server = response.headers.get("x-server-id") or response_data.get("server")
+            self.log.append(scheduled_time, request_start_time, request_end_time, latency, service_latency,
+                            latency_on_server, difficulty, status, ERROR_NONE, server, trace_id)
+        except Exception as e:
+            request_end_time = time.time()
+            latency = (loop.time() - scheduled_loop_time) * 1000
+            status, server = "error", None
+            nan = float("nan")
+            self.log.append(scheduled_time, request_start_time, request_end_time, latency, nan,
+                            nan, difficulty, 0, error_code(e), server, trace_id)
+
+        self.histograms.record(latency * 1000, status, server, round(difficulty))
+        self.requests_done += 1
+
+    async def run_async(self):
+        """
+        Gera carga em malha aberta: as requisições são disparadas nos instantes
+        planejados, sem esperar as respostas anteriores, então a taxa enviada não
+        cai quando o servidor fica lento.
+        """
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections)
+        # Cada resposta vai para o escritor em segundo plano, sem acumular os resultados em memória
+        with ResultLogWriter(self.log_file) as self.log:
+            async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.timeout) as client:
+                loop = asyncio.get_running_loop()
+                # Mapeia o relógio monotônico do loop para o relógio de parede usado nos logs
+                wall_offset = time.time() - loop.time()
+                start = loop.time()
+                stop = start + self.duration
+                next_send = start + self.next_interval()
+                tasks = set()
+                lags = []
+
+                while next_send < stop:
+                    delay = next_send - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    # Atraso do disparo em relação ao instante planejado
+                    lags.append(loop.time() - next_send)
+                    task = asyncio.create_task(self.send_request(client, next_send + wall_offset, next_send))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    next_send += self.next_interval()
+
+                send_elapsed = loop.time() - start
+                if tasks:
+                    await asyncio.wait(tasks)
+
+        self.summary = self.build_summary(len(lags), send_elapsed, lags)
+
+    def build_summary(self, sent, send_elapsed, lags):
+        """Resume quanto a taxa efetiva de envio se afastou da taxa alvo."""
+        lags = sorted(lags)
+        actual_rps = sent / self.duration if self.duration else 0
+        return {
+            "target_rps": self.max_rps,
+            "actual_rps": actual_rps,
+            "rate_drift_pct": (actual_rps - self.max_rps) / self.max_rps * 100 if self.max_rps else 0,
+            "arrival": self.arrival,
+            "duration": self.duration,
+            "send_elapsed": send_elapsed,
+            "requests_sent": sent,
+            "send_lag_mean_ms": sum(lags) / len(lags) * 1000 if lags else 0,
+            "send_lag_p99_ms": lags[int(0.99 * (len(lags) - 1))] * 1000 if lags else 0,
+            "send_lag_max_ms": lags[-1] * 1000 if lags else 0,
+        }
+
     def run(self):
-        """Executa o teste de carga respeitando o limite de RPS."""
-        print(f"Iniciando teste de carga com limite de {self.max_rps*10} RPS por {self.duration} segundos...")
-        threads = []
-        for _ in range(10):  # Criar múltiplas threads para distribuir carga
-            t = threading.Thread(target=self.send_request)
-            t.start()
-            threads.append(t)
-        
-        for t in threads:
-            t.join()
-        
+        """Executa o teste de carga na taxa alvo."""
+        print(f"Iniciando teste de carga em malha aberta ({self.arrival}) com {self.max_rps} RPS por {self.duration} segundos...")
+        asyncio.run(self.run_async())
+        print(f"Taxa efetiva: {self.summary['actual_rps']:.1f} RPS "
+              f"(desvio de {self.summary['rate_drift_pct']:+.2f}%, atraso p99 de envio {self.summary['send_lag_p99_ms']:.2f} ms)")
         self.save_logs()
-    
+
+    def summary_file(self):
+        return os.path.splitext(self.log_file)[0] + "-summary.json"
+
+    def histograms_file(self):
+        return os.path.splitext(self.log_file)[0] + "-histograms.json"
+
     def save_logs(self):
-        """Salva os logs no final do teste para evitar I/O frequente."""
-        with open(self.log_file, "w") as log:
-            for entry in self.results:
-                log.write(json.dumps(entry) + "\n")
+        """Salva o resumo e os histogramas; o log por requisição já foi escrito durante o teste."""
+        self.summary["requests_completed"] = self.requests_done
+        self.summary["latency"] = self.histograms.combined().summary_ms()
+        with open(self.summary_file(), "w") as f:
+            json.dump(self.summary, f)
+        self.histograms.save(self.histograms_file())
 
 if __name__ == "__main__":
-    tester = LoadTester("http://localhost:8080", duration=5, max_rps=1)
+    tester = LoadTester("http://localhost:8080", duration=5, max_rps=100)
     tester.run()
@@ -0,0 +1,230 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import httpx
+
+SERVERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "servers")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# Implementação do load balancer escolhida por LB_ENGINE
+LB_SCRIPTS = {"sanic": "load_balancer.py", "streams": "fast_proxy.py"}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_http(url, timeout=30, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(interval)
+    return False
+
+def process_tree(pid):
+    """pid e todos os seus descendentes, lidos de /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])  # utime + stime
+    return total / CLOCK_TICKS
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+def available_cpus():
+    """CPUs em que este processo pode rodar (a máscara de afinidade, não só os.cpu_count())."""
+    return sorted(os.sched_getaffinity(0))
+
+def assign_cpus(cpus, cores):
+    """
+    Distribui as CPUs entre os servidores em blocos consecutivos, disjuntos
+    enquanto houver CPUs suficientes (depois os blocos se sobrepõem).
+
+    :param cpus: Lista de CPUs disponíveis
+    :param cores: {vm_id: núcleos}
+    :return: ({vm_id: conjunto de CPUs}, CPUs que sobraram para o load balancer,
+             ou todas se não sobrou nenhuma)
+    """
+    assigned, position = {}, 0
+    for vm_id, count in sorted(cores.items()):
+        count = min(count, len(cpus))
+        assigned[vm_id] = {cpus[(position + i) % len(cpus)] for i in range(count)}
+        position += count
+    rest = set(cpus[position:]) or set(cpus)
+    return assigned, rest
+
+def set_tree_affinity(pid, cpus):
+    """Aplica a afinidade a todas as threads de pid e dos seus descendentes."""
+    for member in process_tree(pid):
+        try:
+            tasks = os.listdir(f"/proc/{member}/task")
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                os.sched_setaffinity(int(task), cpus)
+            except OSError:
+                pass
+
+def mem_total_bytes():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+class LocalCluster:
+    """
+    Substituto local das VMs do Proxmox para testar o pipeline de ponta a ponta:
+    dois http_multi_core_server e um load_balancer rodando como processos nesta
+    máquina, em portas livres de 127.0.0.1.
+
+    Com pin=True os núcleos de cada "VM" são CPUs reais: cada servidor é
+    iniciado com afinidade restrita ao seu bloco de CPUs (assign_cpus), e o
+    servidor dimensiona o pool pela afinidade, como uma VM pelos vCPUs. O load
+    balancer fica com as CPUs que sobrarem e é remanejado sem reiniciar.
+    """
+
+    def __init__(self, env=None, pin=True):
+        self.env = {**os.environ, **(env or {})}
+        self.hash_ports = {1: free_port(), 2: free_port()}
+        self.lb_port = free_port()
+        self.lb_url = f"http://127.0.0.1:{self.lb_port}"
+        self.processes = {}
+        self.cores = {1: 1, 2: 1}
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.cpus = available_cpus() if self.pin else []
+
+    def cpu_sets(self):
+        return assign_cpus(self.cpus, self.cores)
+
+    def effective_cores(self, vm_id):
+        """Núcleos que o servidor realmente tem (menos que os pedidos se faltarem CPUs)."""
+        return len(self.cpu_sets()[0][vm_id]) if self.pin else self.cores[vm_id]
+
+    def start_server(self, vm_id):
+        env = {**self.env, "HASH_HOST": "127.0.0.1", "HASH_PORT": str(self.hash_ports[vm_id])}
+        preexec_fn = None
+        if self.pin:
+            servers, lb_cpus = self.cpu_sets()
+            if self.cores[vm_id] > len(servers[vm_id]):
+                print(f"⚠ Só há {len(self.cpus)} CPU(s); servidor {vm_id} fica com {len(servers[vm_id])}.")
+            # A afinidade vale desde o início, então o servidor já sobe com NUM_CORES certo
+            preexec_fn = lambda: os.sched_setaffinity(0, servers[vm_id])
+            if "lb" in self.processes:
+                set_tree_affinity(self.processes["lb"].pid, lb_cpus)
+        self.processes[vm_id] = subprocess.Popen(
+            [sys.executable, "http_multi_core_server.py"], cwd=SERVERS_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=preexec_fn,
+        )
+        return wait_for_http(f"http://127.0.0.1:{self.hash_ports[vm_id]}/health", interval=0.05)
+
+    def stop_server(self, vm_id):
+        process = self.processes.pop(vm_id, None)
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def start(self):
+        for vm_id in self.hash_ports:
+            if not self.start_server(vm_id):
+                raise RuntimeError(f"Servidor local {vm_id} não respondeu")
+        env = {**self.env, "LB_HOST": "127.0.0.1", "LB_PORT": str(self.lb_port)}
+        preexec_fn = None
+        if self.pin:
+            lb_cpus = self.cpu_sets()[1]
+            preexec_fn = lambda: os.sched_setaffinity(0, lb_cpus)
+        self.processes["lb"] = subprocess.Popen(
+            [sys.executable, LB_SCRIPTS[self.env.get("LB_ENGINE", "sanic")]], cwd=SERVERS_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=preexec_fn,
+        )
+        if not wait_for_http(f"{self.lb_url}/admin/config"):
+            raise RuntimeError("Load balancer local não respondeu")
+        return self
+
+    def stop(self):
+        for key in list(self.processes):
+            self.stop_server(key)
+
+    def server_address(self, vm_id):
+        return "127.0.0.1", self.hash_ports[vm_id]
+
+    def pid(self, vm_id):
+        return self.processes[vm_id].pid
+
+    def affinity(self):
+        """CPUs de cada processo do cluster, lidas do sistema."""
+        return {key: sorted(os.sched_getaffinity(process.pid)) for key, process in self.processes.items()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class LocalVMManager:
+    """
+    Mesma interface usada do ProxmoxVMManager. Trocar os núcleos reinicia só o
+    processo do servidor com a nova afinidade, o que leva segundos em vez do
+    ciclo parar/configurar/iniciar da VM.
+    """
+
+    def __init__(self, cluster, vm_id):
+        self.cluster = cluster
+        self.vm_id = vm_id
+
+    def get_cpu_cores(self):
+        return self.cluster.cores[self.vm_id]
+
+    def update_vm_cores(self, cores):
+        print(f"[dry-run] Reiniciando servidor local {self.vm_id} com {cores} núcleo(s)...")
+        started = time.monotonic()
+        self.cluster.stop_server(self.vm_id)
+        self.cluster.cores[self.vm_id] = cores
+        ok = self.cluster.start_server(self.vm_id)
+        if ok and self.cluster.pin:
+            cpus = sorted(os.sched_getaffinity(self.cluster.pid(self.vm_id)))
+            print(f"[dry-run] Servidor {self.vm_id} pronto em {time.monotonic() - started:.1f}s nas CPUs {cpus}")
+        return ok
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+import httpx
+
+class MetricsCollector:
+    """
+    Coleta CPU e RAM de várias VMs e nós do Proxmox num único loop asyncio.
+
+    Todas as consultas usam uma só sessão httpx com conexões keep-alive, em vez
+    de uma conexão TLS nova por amostra. A cada tick todos os alvos são
+    consultados em paralelo. Os ticks seguem start + k * interval no relógio
+    monotônico, então atrasos de uma amostra não se acumulam nas próximas; se a
+    consulta anterior de um alvo ainda não terminou no tick seguinte, aquela
+    amostra é pulada (e contada) em vez de empilhar requisições.
+
+    Cada amostra vira um registro JSON por linha com o instante em que foi
+    planejada e o instante (relógio de parede) em que a resposta chegou, para
+    ser cruzado com os logs de requisições.
+    """
+
+    def __init__(self, ip, token, targets, log_file=None, interval=0.5, base_url=None,
+                 timeout=2, flush_records=256):
+        """
+        :param ip: IP ou domínio do Proxmox
+        :param token: Token da API no formato 'USER@REALM!TOKEN_NAME=TOKEN_VALUE'
+        :param targets: Lista de dicts {"label", "node"} para nós,
+                        {"label", "node", "vm_id"} para VMs ou {"label", "url"}
+                        para o /metrics (formato Prometheus) do load balancer
+                        ou de um servidor
+        :param log_file: Arquivo JSON lines de saída (None mantém os registros só em memória)
+        :param interval: Intervalo entre amostras, em segundos (pode ser menor que 1)
+        :param base_url: Substitui https://{ip}:8006, por exemplo para a API simulada
+        :param flush_records: Registros acumulados antes de escrever no arquivo
+        """
+        self.base_url = (base_url or f"https://{ip}:8006").rstrip("/")
+        self.headers = {"Authorization": f"PVEAPIToken={token}"}
+        self.targets = targets
+        self.log_file = log_file
+        self.interval = interval
+        self.timeout = timeout
+        self.flush_records = flush_records
+        self.buffer = []
+        self.records = []
+        self.samples = 0
+        self.failures = 0
+        self.skipped = 0
+        self.first_sample = asyncio.Event()
+        self.stopped = asyncio.Event()
+
+    def target_path(self, target):
+        if "url" in target:
+            return target["url"]
+        if "vm_id" in target:
+            return f"/api2/json/nodes/{target['node']}/qemu/{target['vm_id']}/status/current"
+        return f"/api2/json/nodes/{target['node']}/status"
+
+    @staticmethod
+    def parse_usage(target, data):
+        if "vm_id" in target:
+            mem_used, mem_total = data.get("mem", 0), data.get("maxmem", 0)
+        else:
+            memory = data.get("memory", {})
+            mem_used, mem_total = memory.get("used", 0), memory.get("total", 0)
+        return {
+            # A API informa CPU como fração dos núcleos da VM (ou do nó)
+            "cpu_pct": round(data.get("cpu", 0) * 100, 4),
+            "cpus": data.get("cpus", data.get("cpuinfo", {}).get("cpus")),
+            "mem_used_mb": round(mem_used / (1024 * 1024), 2),
+            "mem_total_mb": round(mem_total / (1024 * 1024), 2),
+            "mem_pct": round(mem_used / mem_total * 100, 2) if mem_total else 0,
+        }
+
+    async def sample(self, client, target, scheduled):
+        sent = time.monotonic()
+        record = {"scheduled": scheduled, "label": target["label"]}
+        try:
+            # O token só vai para a API do Proxmox, nunca para os /metrics
+            headers = None if "url" in target else self.headers
+            response = await client.get(self.target_path(target), headers=headers)
+            if response.status_code != 200:
+                raise httpx.HTTPStatusError(f"status {response.status_code}", request=response.request, response=response)
+            if "url" in target:
+                record["metrics"] = parse_metrics(response.text)
+            else:
+                record.update(self.parse_usage(target, response.json().get("data", {})))
+            self.samples += 1
+            self.first_sample.set()
+        except (httpx.HTTPError, ValueError) as e:
+            record["error"] = str(e) or type(e).__name__
+            self.failures += 1
+        record["time"] = time.time()
+        record["api_latency_ms"] = round((time.monotonic() - sent) * 1000, 3)
+        self.add_record(record)
+
+    def add_record(self, record):
+        if self.log_file is None:
+            self.records.append(record)
+            return
+        self.buffer.append(record)
+        if len(self.buffer) >= self.flush_records:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with open(self.log_file, "a") as log:
+            log.write("".join(json.dumps(record) + "\n" for record in self.buffer))
+        self.buffer.clear()
+
+    def stop(self):
+        self.stopped.set()
+
+    async def run(self, duration=None):
+        """Amostra até duration segundos se passarem ou stop() ser chamado."""
+        limits = httpx.Limits(max_connections=len(self.targets), max_keepalive_connections=len(self.targets))
+        async with httpx.AsyncClient(base_url=self.base_url, verify=False,
+                                     timeout=self.timeout, limits=limits) as client:
+            loop = asyncio.get_running_loop()
+            wall_offset = time.time() - loop.time()
+            start = loop.time()
+            pending = {}
+            tick = 0
+            try:
+                while not self.stopped.is_set():
+                    scheduled = start + tick * self.interval
+                    if duration is not None and scheduled - start >= duration:
+                        break
+                    for target in self.targets:
+                        task = pending.get(target["label"])
+                        if task is not None and not task.done():
+                            self.skipped += 1
+                            continue
+                        pending[target["label"]] = asyncio.create_task(
+                            self.sample(client, target, scheduled + wall_offset))
+
+                    # Próximo tick no horário planejado; ticks já perdidos são descartados
+                    tick += 1
+                    now = loop.time()
+                    if start + tick * self.interval < now:
+                        missed = int((now - start) / self.interval) + 1 - tick
+                        self.skipped += missed * len(self.targets)
+                        tick += missed
+                    try:
+                        await asyncio.wait_for(self.stopped.wait(), start + tick * self.interval - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+                running = [task for task in pending.values() if not task.done()]
+                if running:
+                    await asyncio.wait(running)
+            finally:
+                if self.log_file is not None:
+                    self.flush()
+
+    def stats(self):
+        return {"samples": self.samples, "failures": self.failures, "skipped": self.skipped}
+
+def parse_metrics(text):
+    """
+    Lê o formato texto do Prometheus como {"nome{rótulos}": valor}. As linhas
+    _bucket dos histogramas ficam de fora; _sum e _count bastam para médias.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        if "_bucket{" not in name:
+            samples[name] = float(value)
+    return samples
+
+def load_metrics(path):
+    """Lê os registros JSON lines escritos pelo MetricsCollector."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import time
+from modules.local_cluster_module import process_tree, cpu_seconds, rss_bytes, mem_total_bytes
+
+VM_STATUS_PATH = re.compile(r"^/api2/json/nodes/(?P<node>[^/]+)/qemu/(?P<vm_id>\d+)/status/current$")
+NODE_STATUS_PATH = re.compile(r"^/api2/json/nodes/(?P<node>[^/]+)/status$")
+
+class MockProxmoxAPI:
+    """
+    Servidor HTTP local que imita os endpoints de status do Proxmox usados pelo
+    MetricsCollector, para testar a coleta sem um Proxmox real.
+
+    Por padrão as VMs reportam uma carga sintética (senoide) por vm_id. Com
+    "resolve_vm" a VM passa a reportar a árvore de processos local devolvida
+    por resolve_vm(vm_id) -> (pid, núcleos), lida de /proc, como no dry-run.
+    """
+
+    def __init__(self, token=None, resolve_vm=None, delay=0.0):
+        """
+        :param token: Se definido, exige o cabeçalho 'Authorization: PVEAPIToken=<token>'
+        :param resolve_vm: Função opcional vm_id -> (pid, núcleos) ou None
+        :param delay: Atraso artificial (s) por resposta, para testar amostras lentas
+        """
+        self.token = token
+        self.resolve_vm = resolve_vm
+        self.delay = delay
+        self.requests = 0
+        self.connections = 0
+        self.started = time.monotonic()
+        self.last_cpu = {}
+        self.server = None
+        self.port = None
+
+    def vm_status(self, vm_id):
+        if self.resolve_vm is not None:
+            resolved = self.resolve_vm(vm_id)
+            if resolved is not None:
+                return self.local_vm_status(vm_id, *resolved)
+        elapsed = time.monotonic() - self.started
+        return {
+            "status": "running",
+            "cpus": 1,
+            "cpu": 0.5 + 0.4 * math.sin(elapsed + vm_id),
+            "mem": (512 + vm_id) * 1024 * 1024,
+            "maxmem": 2048 * 1024 * 1024,
+        }
+
+    def local_vm_status(self, vm_id, pid, cores):
+        pids = process_tree(pid)
+        now, cpu_time = time.monotonic(), cpu_seconds(pids)
+        last = self.last_cpu.get(vm_id)
+        self.last_cpu[vm_id] = (pid, now, cpu_time)
+        # Como o Proxmox, a CPU é calculada desde a consulta anterior
+        cpu = 0.0
+        if last is not None and last[0] == pid and now > last[1]:
+            cpu = (cpu_time - last[2]) / (now - last[1]) / cores
+        return {"status": "running", "cpus": cores, "cpu": cpu,
+                "mem": rss_bytes(pids), "maxmem": mem_total_bytes()}
+
+    def node_status(self, node):
+        with open("/proc/loadavg") as f:
+            loadavg = f.read().split()[:3]
+        cpus = os.cpu_count()
+        total = mem_total_bytes()
+        with open("/proc/meminfo") as f:
+            available = next(int(line.split()[1]) * 1024 for line in f if line.startswith("MemAvailable:"))
+        return {
+            "cpu": min(1.0, float(loadavg[0]) / cpus),
+            "cpuinfo": {"cpus": cpus},
+            "loadavg": loadavg,
+            "memory": {"used": total - available, "total": total},
+        }
+
+    def route(self, method, path, headers):
+        if self.token is not None and headers.get("authorization") != f"PVEAPIToken={self.token}":
+            return 401, {"data": None, "message": "authentication failure"}
+        if method != "GET":
+            return 501, {"data": None}
+        match = VM_STATUS_PATH.match(path)
+        if match:
+            return 200, {"data": self.vm_status(int(match.group("vm_id")))}
+        match = NODE_STATUS_PATH.match(path)
+        if match:
+            return 200, {"data": self.node_status(match.group("node"))}
+        return 404, {"data": None}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, _, header_block = head.decode("latin-1").partition("\r\n")
+                method, path, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in header_block.split("\r\n"):
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length:
+                    await reader.readexactly(length)
+
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                status, payload = self.route(method, path.split("?", 1)[0], headers)
+                body = json.dumps(payload).encode()
+                writer.write(
+                    b"HTTP/1.1 %d OK\r\n"
+                    b"content-type: application/json;charset=UTF-8\r\n"
+                    b"content-length: %d\r\n\r\n" % (status, len(body)) + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+async def serve(port, token=None):
+    api = MockProxmoxAPI(token)
+    url = await api.start(port=port)
+    print(f"API simulada do Proxmox em {url}")
+    async with api.server:
+        await api.server.serve_forever()
+
+# Uso: python -m modules.mock_proxmox_module [porta], a partir de client/
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8006, os.getenv("PROXMOX_TOKEN")))
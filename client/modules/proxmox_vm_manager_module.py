@@ -24,6 +24,17 @@ class ProxmoxVMManager:
         response = requests.post(url, headers=self.headers, verify=False)
         return response.status_code == 200
 
+    def get_cpu_cores(self):
+        """Retorna a quantidade de núcleos configurada na VM (None se a consulta falhar)."""
+        url = f"{self.proxmox_url}/api2/json/nodes/{self.node}/qemu/{self.vm_id}/config"
+        try:
+            response = requests.get(url, headers=self.headers, verify=False, timeout=5)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.json().get("data", {}).get("cores")
+
     def set_cpu_cores(self, cores):
         """Altera a quantidade de núcleos da VM."""
         url = f"{self.proxmox_url}/api2/json/nodes/{self.node}/qemu/{self.vm_id}/config"
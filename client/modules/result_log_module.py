@@ -0,0 +1,179 @@
+import os
+import queue
+import shutil
+import struct
+import threading
+
+# Formato binário do log de requisições: um cabeçalho fixo seguido de registros
+# de tamanho fixo, um por requisição, que podem ser lidos direto como um array
+# estruturado do NumPy (uma coluna por campo) sem nenhum parsing.
+MAGIC = b"LTRLOG02"
+
+# (nome, formato struct, dtype NumPy); sempre little-endian e sem padding
+FIELDS = [
+    ("request_scheduled", "d", "<f8"),
+    ("request_sent", "d", "<f8"),
+    ("request_received", "d", "<f8"),
+    ("latency", "d", "<f8"),
+    ("service_latency", "d", "<f8"),
+    ("latency_on_server", "d", "<f8"),
+    ("difficulty", "d", "<f8"),
+    ("status", "h", "<i2"),
+    ("error", "B", "u1"),
+    ("server", "32s", "S32"),
+    # ID enviado no cabeçalho X-Trace-Id (16 dígitos hex), para cruzar com os traces dos servidores
+    ("trace_id", "Q", "<u8"),
+]
+RECORD = struct.Struct("<" + "".join(fmt for _, fmt, _ in FIELDS))
+FIELD_NAMES = [name for name, _, _ in FIELDS]
+
+# Cabeçalho: magic + tamanho do registro, para recusar arquivos de outra versão
+HEADER = struct.Struct("<8sI")
+HEADER_BYTES = HEADER.pack(MAGIC, RECORD.size)
+
+# Códigos da coluna "error" (status fica 0 quando não houve resposta)
+ERROR_NONE = 0
+ERROR_TIMEOUT = 1
+ERROR_CONNECT = 2
+ERROR_OTHER = 3
+
+class ResultLogWriter:
+    """
+    Escreve registros de requisições em segundo plano.
+
+    append() só empacota o registro num buffer em memória; quando o buffer
+    enche, ele é entregue a uma thread que faz a escrita em disco. A fila entre
+    os dois é limitada, então a memória usada fica em no máximo
+    (max_pending + 1) * buffer_records registros: se o disco não acompanhar,
+    append() espera em vez de acumular.
+    """
+
+    def __init__(self, path, buffer_records=4096, max_pending=8):
+        """
+        :param path: Arquivo de saída (sobrescrito)
+        :param buffer_records: Registros por bloco entregue à thread de escrita
+        :param max_pending: Blocos que podem aguardar escrita antes de append() bloquear
+        """
+        self.path = path
+        self.buffer = bytearray(buffer_records * RECORD.size)
+        self.offset = 0
+        self.records = 0
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.file = open(path, "wb")
+        self.file.write(HEADER_BYTES)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _write_loop(self):
+        while True:
+            chunk = self.pending.get()
+            if chunk is None:
+                break
+            try:
+                self.file.write(chunk)
+            except OSError as e:
+                self.error = e
+
+    def append(self, request_scheduled, request_sent, request_received, latency, service_latency,
+               latency_on_server, difficulty, status, error, server, trace_id=0):
+        if server is None:
+            server = b""
+        elif not isinstance(server, bytes):
+            server = str(server).encode()
+        RECORD.pack_into(self.buffer, self.offset, request_scheduled, request_sent, request_received,
+                         latency, service_latency, latency_on_server, difficulty, status, error, server, trace_id)
+        self.offset += RECORD.size
+        self.records += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """Entrega o buffer atual à thread de escrita."""
+        if self.error is not None:
+            raise self.error
+        if self.offset:
+            self.pending.put(bytes(self.buffer[:self.offset]))
+            self.offset = 0
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_header(f, path):
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError(f"{path}: arquivo truncado, sem cabeçalho")
+    magic, record_size = HEADER.unpack(header)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f"{path}: não é um log de requisições no formato {MAGIC.decode()}")
+
+def count_records(path):
+    size = os.path.getsize(path) - HEADER.size
+    if size < 0 or size % RECORD.size:
+        raise ValueError(f"{path}: tamanho incompatível com registros de {RECORD.size} bytes")
+    return size // RECORD.size
+
+def merge_result_logs(paths, out_path, chunk_size=16 * 1024 * 1024, remove=False):
+    """
+    Concatena logs binários em out_path lendo blocos de chunk_size bytes, sem
+    carregar nenhum arquivo inteiro em memória.
+
+    :return: Número de registros no arquivo resultante
+    """
+    total = 0
+    with open(out_path, "wb") as f_out:
+        f_out.write(HEADER_BYTES)
+        for path in paths:
+            total += count_records(path)
+            with open(path, "rb") as f_in:
+                read_header(f_in, path)
+                shutil.copyfileobj(f_in, f_out, chunk_size)
+    if remove:
+        for path in paths:
+            os.remove(path)
+    return total
+
+def iter_records(path, chunk_records=65536):
+    """Itera os registros como dicts, em blocos, para uso sem NumPy."""
+    with open(path, "rb") as f:
+        read_header(f, path)
+        while True:
+            data = f.read(chunk_records * RECORD.size)
+            if not data:
+                break
+            for values in RECORD.iter_unpack(data):
+                record = dict(zip(FIELD_NAMES, values))
+                record["server"] = record["server"].rstrip(b"\0").decode()
+                yield record
+
+def record_dtype():
+    import numpy as np
+    return np.dtype([(name, dtype) for name, _, dtype in FIELDS])
+
+def load_result_log(path, mmap=True):
+    """
+    Carrega o log como array estruturado do NumPy (ex.: data["latency"]).
+
+    Com mmap=True o arquivo é mapeado em memória e só as páginas das colunas
+    acessadas são lidas do disco, o que permite abrir logs maiores que a RAM.
+    """
+    import numpy as np
+    with open(path, "rb") as f:
+        read_header(f, path)
+    count = count_records(path)
+    if mmap:
+        if count == 0:
+            return np.zeros(0, dtype=record_dtype())
+        return np.memmap(path, dtype=record_dtype(), mode="r", offset=HEADER.size, shape=(count,))
+    return np.fromfile(path, dtype=record_dtype(), offset=HEADER.size, count=count)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import time
+import httpx
+
+def scenario_name(rps, cores, algorithm):
+    return f"rps{rps}-cores{cores}-alg{algorithm}"
+
+def plan_scenarios(core_levels, rps_levels, algorithms, current_cores=None):
+    """
+    Ordena os cenários do planejamento fatorial agrupando por número de núcleos,
+    já que mudar os núcleos da VM é a etapa mais cara (parar, reconfigurar e
+    religar). O grupo com os núcleos que a VM já tem vai primeiro, então a
+    execução faz no máximo len(core_levels) reconfigurações, ou uma a menos.
+    """
+    core_order = list(dict.fromkeys(core_levels))
+    if current_cores in core_order:
+        core_order.remove(current_cores)
+        core_order.insert(0, current_cores)
+    return [
+        {"name": scenario_name(rps, cores, algorithm), "rps": rps, "cores": cores, "algorithm": algorithm}
+        for cores in core_order
+        for rps in rps_levels
+        for algorithm in algorithms
+    ]
+
+def count_reconfigurations(plan, current_cores=None):
+    changes, cores = 0, current_cores
+    for scenario in plan:
+        if scenario["cores"] != cores:
+            changes += 1
+            cores = scenario["cores"]
+    return changes
+
+class Checkpoint:
+    """
+    Registro dos cenários concluídos, salvo em JSON a cada cenário para que uma
+    execução interrompida possa ser retomada de onde parou.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.completed = data.get("completed", {})
+
+    def is_done(self, name):
+        return name in self.completed
+
+    def pending(self, plan):
+        return [scenario for scenario in plan if not self.is_done(scenario["name"])]
+
+    def mark_done(self, name, **info):
+        self.completed[name] = {"finished_at": time.time(), **info}
+        self.save()
+
+    def save(self):
+        # Escreve num arquivo temporário e troca, para nunca deixar um checkpoint pela metade
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"completed": self.completed}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+async def wait_until(check, timeout, interval=0.25, description="condição"):
+    """
+    Chama a corrotina check() até ela retornar verdadeiro ou o tempo acabar.
+
+    :return: True se a condição foi atingida dentro do timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if await check():
+                return True
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() >= deadline:
+            print(f"⚠ Timeout de {timeout}s aguardando {description}")
+            return False
+        await asyncio.sleep(interval)
+
+async def wait_for_backends(lb_url, server_ids, timeout=60):
+    """Aguarda o load balancer marcar todos os servidores como saudáveis."""
+    server_ids = {str(server_id) for server_id in server_ids}
+
+    async def ready():
+        async with httpx.AsyncClient(timeout=2) as client:
+            response = await client.get(f"{lb_url}/admin/config")
+        if response.status_code != 200:
+            return False
+        health = response.json().get("health", {})
+        return all(health.get(server_id, {}).get("state") == "healthy" for server_id in server_ids)
+
+    return await wait_until(ready, timeout, description="servidores saudáveis no load balancer")
+
+async def wait_for_event(event, timeout):
+    """Aguarda um asyncio.Event com timeout."""
+    async def is_set():
+        return event.is_set()
+    return await wait_until(is_set, timeout, interval=0.05, description="início do monitoramento")
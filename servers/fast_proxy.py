@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Modo alternativo do load balancer sobre streams do asyncio, sem Sanic nem httpx
+no caminho das requisições.
+
+Do HTTP/1.1 só é lido o necessário para escolher o servidor: linha de
+requisição, Content-Length, Connection e, em POST /hash, a dificuldade do
+corpo. O cabeçalho da requisição segue como chegou (só é remontado se o corpo
+ou o Connection mudarem) por uma conexão keep-alive de um pool por servidor, e
+a resposta volta ao cliente sem ser decodificada: o cabeçalho recebido, fatiado
+com memoryview para inserir X-Server-Id, e o corpo em blocos conforme
+Content-Length ou chunked. As duas pontas mantêm as conexões abertas.
+
+Balanceamento, custo por dificuldade, circuit breaker, sondagem de saúde,
+trace da requisição (X-Trace-Id, Server-Timing e TRACE_LOG), /admin/config e
+/metrics são os mesmos do load_balancer.py, importado como biblioteca. Só há o
+proxy_mode "passthrough": o corpo da resposta nunca é decodificado, então
+/admin/config recusa "json". Roda em um único processo (LB_WORKERS é
+ignorado), como o load_balancer com LB_WORKERS=1.
+
+    LB_PORT=8080 python fast_proxy.py
+"""
+import asyncio
+import json
+import os
+import time
+
+import load_balancer as lb
+from trace_sink import TRACE_HEADER, trace_id_from
+
+# Limites da leitura do cliente: cabeçalho inteiro e corpo (lido antes de escolher o servidor)
+MAX_HEADER_BYTES = int(os.getenv("FAST_PROXY_MAX_HEADER_BYTES", 64 * 1024))
+MAX_BODY_BYTES = int(os.getenv("FAST_PROXY_MAX_BODY_BYTES", 16 * 1024 * 1024))
+# Tamanho dos blocos ao repassar corpos de resposta grandes
+CHUNK_SIZE = int(os.getenv("FAST_PROXY_CHUNK_SIZE", 64 * 1024))
+# Respostas até este tamanho são lidas inteiras e enviadas com uma escrita só
+SMALL_BODY_BYTES = 256 * 1024
+
+REASONS = {200: b"OK", 400: b"Bad Request", 404: b"Not Found", 405: b"Method Not Allowed",
+           413: b"Payload Too Large", 501: b"Not Implemented", 502: b"Bad Gateway",
+           503: b"Service Unavailable"}
+# Cabeçalhos que são da conexão com o cliente e não vão para o servidor
+CONNECTION_HEADERS = (b"connection", b"keep-alive", b"proxy-connection")
+# Cabeçalhos da resposta que o LB define no lugar dos do servidor
+LB_RESPONSE_HEADERS = tuple(name.encode() for name in lb.LB_RESPONSE_HEADERS)
+# Único modo suportado: a resposta segue sem ser decodificada
+PROXY_MODE = "passthrough"
+
+class UpstreamError(Exception):
+    """Falha ao falar com o servidor antes de qualquer byte da resposta chegar ao cliente."""
+
+def parse_head(head):
+    """
+    Lê um cabeçalho HTTP/1.x terminado em CRLF CRLF.
+
+    :return: (linha inicial separada por espaços, {nome em minúsculas: valor}, linhas)
+    """
+    lines = head[:-4].split(b"\r\n")
+    start = lines[0].split(b" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip()
+    return start, headers, lines
+
+def wants_keep_alive(version, headers):
+    connection = headers.get(b"connection", b"").lower()
+    if version == b"HTTP/1.0":
+        return b"keep-alive" in connection
+    return b"close" not in connection
+
+def header_lines(headers):
+    return b"".join(b"%s: %s\r\n" % (name.encode(), value.encode("latin-1")) for name, value in headers.items())
+
+def simple_response(status, body, content_type=b"application/json", keep_alive=True, headers=None):
+    return b"".join([
+        b"HTTP/1.1 %d %s\r\n" % (status, REASONS.get(status, b"")),
+        b"content-type: ", content_type, b"\r\n",
+        b"content-length: %d\r\n" % len(body),
+        b"" if keep_alive else b"connection: close\r\n",
+        header_lines(headers) if headers else b"",
+        b"\r\n", body,
+    ])
+
+def json_response(status, data, keep_alive=True, headers=None):
+    return simple_response(status, json.dumps(data).encode(), keep_alive=keep_alive, headers=headers)
+
+def sanic_response(resp, keep_alive=True):
+    """Serializa uma resposta montada pelas funções do load_balancer (config_response etc.)."""
+    content_type = (resp.content_type or "application/json").encode()
+    return simple_response(resp.status, resp.body or b"", content_type, keep_alive=keep_alive)
+
+class UpstreamPool:
+    """Conexões keep-alive ociosas com cada servidor, com limite de conexões abertas."""
+
+    def __init__(self):
+        self.idle = {}
+        self.limits = {}
+
+    def limit(self, key):
+        semaphore = self.limits.get(key)
+        if semaphore is None:
+            semaphore = self.limits[key] = asyncio.Semaphore(lb.UPSTREAM_MAX_CONNECTIONS)
+        return semaphore
+
+    async def acquire(self, server):
+        """:return: (reader, writer, reaproveitada)"""
+        idle = self.idle.get(lb.server_key(server))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(server["host"], server["port"], limit=MAX_HEADER_BYTES),
+            lb.UPSTREAM_TIMEOUT,
+        )
+        return reader, writer, False
+
+    def release(self, server, connection, reusable):
+        idle = self.idle.setdefault(lb.server_key(server), [])
+        if reusable and len(idle) < lb.UPSTREAM_MAX_KEEPALIVE:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    def prune(self, servers):
+        """Fecha as conexões de servidores que saíram da configuração."""
+        keys = {lb.server_key(srv) for srv in servers}
+        for key in [key for key in self.idle if key not in keys]:
+            for _, writer in self.idle.pop(key):
+                writer.close()
+
+pool = UpstreamPool()
+
+def request_trace_id(headers):
+    value = headers.get(TRACE_HEADER.encode())
+    return trace_id_from({TRACE_HEADER: value.decode("latin-1")} if value else {})
+
+def upstream_head(lines, headers, body_changed, body, trace_id):
+    """
+    Cabeçalho enviado ao servidor: o original, remontado só se for preciso
+    (corpo reescrito, cabeçalhos de conexão ou X-Trace-Id ausente ou cortado).
+    """
+    trace_header = trace_id.encode("latin-1")
+    if (not body_changed and headers.get(TRACE_HEADER.encode()) == trace_header
+            and not any(name in headers for name in CONNECTION_HEADERS)):
+        return None
+    dropped = CONNECTION_HEADERS + (b"content-length", TRACE_HEADER.encode())
+    kept = [line for line in lines[1:] if line.partition(b":")[0].strip().lower() not in dropped]
+    return b"\r\n".join([lines[0], *kept, b"content-length: %d" % len(body),
+                          b"%s: %s" % (TRACE_HEADER.encode(), trace_header), b"", b""])
+
+def client_head(response_head, lines, headers, server, trace):
+    """
+    Cabeçalho da resposta ao cliente com X-Server-Id, X-Trace-Id e o
+    Server-Timing do LB seguido do do servidor, como no load_balancer. Sem
+    cópia (fatiado com memoryview) se o servidor não mandou nenhum deles.
+    """
+    upstream_timing = headers.get(b"server-timing")
+    lb_headers = {
+        "x-server-id": str(server["id"]),
+        "x-trace-id": trace.trace_id,
+        "server-timing": trace.header(upstream_timing.decode("latin-1") if upstream_timing else None),
+    }
+    added = header_lines(lb_headers) + b"\r\n"
+    if not any(name in headers for name in LB_RESPONSE_HEADERS):
+        return [memoryview(response_head)[:-2], added]
+    kept = [line for line in lines if line.partition(b":")[0].strip().lower() not in LB_RESPONSE_HEADERS]
+    return [b"\r\n".join(kept) + b"\r\n", added]
+
+async def relay_body(upstream, client, headers, no_body):
+    """
+    Repassa o corpo da resposta conforme o enquadramento do servidor.
+
+    :return: True se a conexão com o servidor pode voltar ao pool
+    """
+    if no_body:
+        return True
+    if b"chunked" in headers.get(b"transfer-encoding", b"").lower():
+        while True:
+            size_line = await upstream.readuntil(b"\r\n")
+            client.write(size_line)
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Trailers opcionais até a linha vazia
+                while True:
+                    line = await upstream.readuntil(b"\r\n")
+                    client.write(line)
+                    if line == b"\r\n":
+                        return True
+            client.write(await upstream.readexactly(size + 2))
+            await client.drain()
+    length = headers.get(b"content-length")
+    if length is None:
+        # Sem tamanho: o corpo vai até o servidor fechar a conexão
+        while chunk := await upstream.read(CHUNK_SIZE):
+            client.write(chunk)
+            await client.drain()
+        return False
+    remaining = int(length)
+    while remaining > 0:
+        chunk = await upstream.read(min(remaining, CHUNK_SIZE))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        client.write(chunk)
+        remaining -= len(chunk)
+        await client.drain()
+    return True
+
+async def forward(server, method, head, body, client, trace):
+    """
+    Envia a requisição ao servidor e repassa a resposta ao cliente, somando
+    em trace os tempos de espera, conexão e resposta do servidor.
+
+    :return: (status, conexão com o cliente pode continuar aberta)
+    :raises UpstreamError: se nada foi enviado ao cliente ainda
+    """
+    durations = trace.durations
+    waited = time.monotonic()
+    async with pool.limit(lb.server_key(server)):
+        for attempt in (0, 1):
+            acquiring = time.monotonic()
+            durations["upstream_wait"] += acquiring - waited
+            try:
+                reader, writer, reused = await pool.acquire(server)
+            except (OSError, asyncio.TimeoutError) as e:
+                durations["upstream_connect"] += time.monotonic() - acquiring
+                raise UpstreamError(str(e) or type(e).__name__)
+            sent = time.monotonic()
+            durations["upstream_wait" if reused else "upstream_connect"] += sent - acquiring
+            try:
+                writer.writelines([head, body])
+                response_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), lb.UPSTREAM_TIMEOUT)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                # Conexão ociosa que o servidor já tinha fechado: tenta uma nova uma vez
+                if reused and attempt == 0:
+                    continue
+                raise UpstreamError(str(e) or type(e).__name__)
+            except (asyncio.TimeoutError, asyncio.LimitOverrunError, OSError) as e:
+                writer.close()
+                raise UpstreamError(str(e) or type(e).__name__)
+            finally:
+                waited = time.monotonic()
+                durations["upstream"] += waited - sent
+
+        try:
+            start, headers, lines = parse_head(response_head)
+            version, status = start[0], int(start[1])
+            length = int(headers[b"content-length"]) if b"content-length" in headers else None
+            if length is not None and length < 0:
+                raise ValueError("negative Content-Length")
+        except (ValueError, IndexError):
+            writer.close()
+            raise UpstreamError("Invalid response from upstream server")
+        trace.status = status
+        no_body = method == b"HEAD" or status in (204, 304) or status < 200
+        head_parts = client_head(response_head, lines, headers, server, trace)
+        reusable = False
+        try:
+            if not no_body and length is not None and length <= SMALL_BODY_BYTES:
+                try:
+                    response_body = await reader.readexactly(length)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    raise UpstreamError(str(e) or type(e).__name__)
+                client.writelines([*head_parts, response_body])
+                reusable = True
+            else:
+                client.writelines(head_parts)
+                reusable = await relay_body(reader, client, headers, no_body)
+            await client.drain()
+            reusable = reusable and wants_keep_alive(version, headers)
+        finally:
+            pool.release(server, (reader, writer), reusable)
+        # Se o servidor encerrou a conexão sem tamanho de corpo, o cliente também precisa
+        return status, reusable or length is not None or no_body
+
+async def proxy(method, path, head, lines, headers, body, client, keep_alive, arrival):
+    """Escolhe o servidor, com novas tentativas e trace como no proxy_request do Sanic."""
+    trace = lb.RequestTrace(request_trace_id(headers), arrival)
+    received = time.monotonic()
+    trace.durations["lb_queue"] = received - arrival
+    body_changed, cost = False, 1.0
+    if path == b"/" + lb.HASH_PATH.encode() and method == b"POST":
+        try:
+            new_body, difficulty = lb.normalize_hash_body(body)
+        except ValueError as e:
+            trace.finish(None, 400)
+            client.write(json_response(400, {"error": str(e)}, keep_alive, {"X-Trace-Id": trace.trace_id}))
+            return keep_alive
+        body_changed, body, cost = new_body is not body, new_body, lb.request_cost(difficulty)
+    upstream_request = upstream_head(lines, headers, body_changed, body, trace.trace_id) or head
+
+    tried = set()
+    while True:
+        strategy = lb.balancer
+        select_start = time.monotonic()
+        server = lb.get_next_server(tried, cost)
+        trace.durations["lb_select"] += time.monotonic() - select_start
+        if not server:
+            if tried:
+                break
+            trace.finish(None, 503)
+            client.write(json_response(503, {"error": "No servers configured"}, keep_alive,
+                                       {"X-Trace-Id": trace.trace_id, "Server-Timing": trace.header()}))
+            return keep_alive
+        tried.add(lb.server_key(server))
+        trace.attempts += 1
+
+        lb.request_started(server, cost)
+        started = time.monotonic()
+        failed = True
+        try:
+            status, reusable = await forward(server, method, upstream_request, body, client, trace)
+            failed = status >= 500
+            lb.record_upstream_result(server, False)
+            trace.finish(server, status)
+            return keep_alive and reusable
+        except UpstreamError as e:
+            lb.record_upstream_result(server, True)
+            error, failed_server = e, server
+        finally:
+            lb.request_finished(server, cost)
+            latency = time.monotonic() - started
+            strategy.on_request_end(server, latency, failed)
+            lb.record_attempt(server, latency, failed)
+
+        if len(tried) > lb.MAX_RETRIES or time.monotonic() - received >= lb.RETRY_BUDGET:
+            break
+
+    trace.finish(failed_server, 502)
+    client.write(json_response(
+        502, {"error": f"Failed to connect to upstream server: {error}", "server_id": failed_server["id"]},
+        keep_alive, {"X-Trace-Id": trace.trace_id, "Server-Timing": trace.header()}))
+    return keep_alive
+
+async def admin(method, path, body, keep_alive):
+    """/admin/config e /metrics, com as mesmas respostas do load_balancer."""
+    if path == b"/metrics":
+        if method != b"GET":
+            return json_response(405, {"error": "Method not allowed"}, keep_alive)
+        return sanic_response(await lb.metrics_endpoint(None), keep_alive)
+    if path != b"/admin/config":
+        return json_response(404, {"error": "Not found"}, keep_alive)
+    if method == b"GET":
+        return sanic_response(lb.config_response(), keep_alive)
+    if method != b"POST":
+        return json_response(405, {"error": "Method not allowed"}, keep_alive)
+    try:
+        config_data = json.loads(body)
+    except ValueError:
+        return json_response(400, {"error": "Invalid JSON body"}, keep_alive)
+    error = lb.validate_config(config_data)
+    if not error and config_data.get("proxy_mode", PROXY_MODE) != PROXY_MODE:
+        error = f"fast_proxy only supports proxy_mode {PROXY_MODE!r}"
+    if error:
+        return json_response(400, {"error": error}, keep_alive)
+    lb.apply_config(config_data)
+    pool.prune(lb.SERVERS)
+    return sanic_response(lb.config_response(status="config_updated"), keep_alive)
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            arrival = time.monotonic()
+            try:
+                (method, target, version), headers, lines = parse_head(head)
+                length = int(headers.get(b"content-length", 0))
+                if length < 0:
+                    raise ValueError("negative Content-Length")
+            except ValueError:
+                # Linha de requisição sem 3 partes ou Content-Length inválido ou negativo
+                writer.write(json_response(400, {"error": "Malformed request"}, keep_alive=False))
+                break
+            keep_alive = wants_keep_alive(version, headers)
+            if b"transfer-encoding" in headers:
+                writer.write(json_response(501, {"error": "Chunked request bodies are not supported"}, False))
+                break
+            if length > MAX_BODY_BYTES:
+                writer.write(json_response(413, {"error": "Request body too large"}, False))
+                break
+            body = await reader.readexactly(length) if length else b""
+            path = target.split(b"?", 1)[0]
+
+            if path in (b"/admin/config", b"/metrics"):
+                writer.write(await admin(method, path, body, keep_alive))
+            else:
+                keep_alive = await proxy(method, path, head, lines, headers, body, writer, keep_alive, arrival)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def serve(host, port):
+    lb.add_task = spawn
+    lb.PROXY_MODE = PROXY_MODE
+    lb.init_worker()
+    spawn(lb.health_check_loop())
+    server = await asyncio.start_server(handle_client, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+    print(f"fast_proxy em http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await lb.close_upstream_clients(None)
+
+if __name__ == "__main__":
+    if lb.LB_WORKERS > 1:
+        print("fast_proxy roda em um único processo; LB_WORKERS ignorado")
+    try:
+        asyncio.run(serve(os.getenv("LB_HOST", "0.0.0.0"), int(os.getenv("LB_PORT", 8080))))
+    except KeyboardInterrupt:
+        pass
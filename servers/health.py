@@ -0,0 +1,74 @@
+import os
+import time
+
+# Falhas consecutivas (requisições ou sondagens) até ejetar um servidor
+EJECT_CONSECUTIVE_FAILURES = int(os.getenv("EJECT_CONSECUTIVE_FAILURES", 3))
+# Tempo de ejeção inicial (s); dobra a cada nova ejeção até EJECT_MAX_TIME
+EJECT_BASE_TIME = float(os.getenv("EJECT_BASE_TIME", 2))
+EJECT_MAX_TIME = float(os.getenv("EJECT_MAX_TIME", 60))
+# Sondagens bem-sucedidas necessárias para um servidor meio-aberto voltar
+HALF_OPEN_SUCCESSES = int(os.getenv("HALF_OPEN_SUCCESSES", 2))
+
+HEALTHY = "healthy"
+EJECTED = "ejected"
+HALF_OPEN = "half_open"
+
+class BackendHealth:
+    """
+    Circuit breaker de um servidor.
+
+    healthy -> ejected: após EJECT_CONSECUTIVE_FAILURES falhas seguidas, vindas
+    de requisições reais (erro de conexão ou timeout) ou da sondagem ativa.
+    ejected -> half_open: quando o tempo de ejeção acaba. Nesse estado o servidor
+    ainda não recebe tráfego, só sondagens.
+    half_open -> healthy: após HALF_OPEN_SUCCESSES sondagens bem-sucedidas.
+    half_open -> ejected: na primeira falha, com tempo de ejeção dobrado.
+    """
+
+    def __init__(self):
+        self.state = HEALTHY
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def available(self, now=None):
+        """Indica se o servidor pode receber requisições reais."""
+        if self.state == EJECTED and (now or time.monotonic()) >= self.ejected_until:
+            self.state = HALF_OPEN
+            self.consecutive_successes = 0
+        return self.state == HEALTHY
+
+    def should_probe(self, now=None):
+        """Servidores ejetados só voltam a ser sondados quando ficam meio-abertos."""
+        self.available(now)
+        return self.state != EJECTED
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.consecutive_successes += 1
+            if self.consecutive_successes >= HALF_OPEN_SUCCESSES:
+                self.state = HEALTHY
+                self.ejections = 0
+
+    def record_failure(self, now=None):
+        self.consecutive_successes = 0
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == HEALTHY and self.consecutive_failures >= EJECT_CONSECUTIVE_FAILURES
+        ):
+            self.eject(now)
+
+    def eject(self, now=None):
+        self.ejections += 1
+        eject_time = min(EJECT_MAX_TIME, EJECT_BASE_TIME * 2 ** (self.ejections - 1))
+        self.state = EJECTED
+        self.ejected_until = (now or time.monotonic()) + eject_time
+
+    def describe(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+        }
@@ -1,18 +1,150 @@
 #!/usr/bin/env python3
 import asyncio
+import multiprocessing
 import time
-import hashlib
 import os
 import socket
-from concurrent.futures import ProcessPoolExecutor
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 
-# Setup FastAPI and the process pool
-app = FastAPI()
-NUM_CORES = os.cpu_count()
-pool = ProcessPoolExecutor(max_workers=NUM_CORES)
+from metrics import (CONTENT_TYPE, LATENCY_BUCKETS, MetricsSchema, WorkerMetrics, open_file_region,
+                     read_file_regions, render, reset_file_regions)
+from pow_solver import CANCELLED, NO_MATCH, init_search_worker, solve, solve_chunk
+from result_cache import ResultCache
+from trace_sink import open_sink, server_timing, trace_id_from
+
+# Cores this process may run on: its CPU affinity mask where the platform has
+# one (taskset, cpusets, the local cluster harness), otherwise every core
+NUM_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+# Execution topology:
+# - "process": one event loop (single uvicorn worker) feeding one shared
+#   ProcessPoolExecutor with NUM_CORES workers.
+# - "thread": one event loop per core (NUM_CORES uvicorn workers), each running
+#   the hash in a single background thread so the loop stays responsive.
+# - "inline": one event loop per core, hashing directly on the loop.
+HASH_TOPOLOGIES = ("process", "thread", "inline")
+HASH_TOPOLOGY = os.getenv("HASH_TOPOLOGY", "process")
+if HASH_TOPOLOGY not in HASH_TOPOLOGIES:
+    raise ValueError(f"HASH_TOPOLOGY must be one of {HASH_TOPOLOGIES}, got {HASH_TOPOLOGY!r}")
+UVICORN_WORKERS = 1 if HASH_TOPOLOGY == "process" else NUM_CORES
+
+# Optionally split the nonce space of one request across idle pool workers.
+# A request is split only if its difficulty is at least SPLIT_MIN_DIFFICULTY and
+# at least two pool workers are idle, so splitting never queues behind other work.
+HASH_SPLIT = os.getenv("HASH_SPLIT", "0") == "1"
+SPLIT_MIN_DIFFICULTY = int(os.getenv("SPLIT_MIN_DIFFICULTY", 5))
+SPLIT_MAX_CHUNKS = int(os.getenv("SPLIT_MAX_CHUNKS", NUM_CORES))
+
+# Admission control: at most COMPUTE_CAPACITY searches run at once and at most
+# HASH_QUEUE_DEPTH more wait for a slot; beyond that requests get a fast 503.
+COMPUTE_CAPACITY = NUM_CORES if HASH_TOPOLOGY == "process" else 1
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", 4 * COMPUTE_CAPACITY))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", 1))
+# How often (s) to check whether the client of a pending request went away
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.1))
+
+# One slot per running search, holding the earliest matching batch (see
+# pow_solver.solve_chunk). Created with the executor in the app lifespan.
+search_best = None
+free_search_slots = []
+compute_slots = None
+# Requests waiting for a compute slot
+queued = 0
+# Executor created in the app lifespan (None when hashing inline)
+pool = None
+# Number of hash tasks submitted and not finished yet
+pool_jobs = 0
+
+# do_hashing always hashes the same data, so its result depends only on the
+# difficulty. The cache is opt-in (HASH_CACHE=1): with it, repeated
+# difficulties are answered without CPU work, so experiments would measure
+# cache hits and the load balancer's per-difficulty cost estimate would not
+# match the work the servers do.
+HASH_CACHE = os.getenv("HASH_CACHE", "0") == "1"
+HASH_CACHE_SIZE = int(os.getenv("HASH_CACHE_SIZE", 128))
+HASH_CACHE_TTL = float(os.getenv("HASH_CACHE_TTL", 300))
+hash_cache = ResultCache(HASH_CACHE_SIZE, HASH_CACHE_TTL) if HASH_CACHE else None
+
+# Path prefix for per-request trace records (see trace_sink); empty disables the file sink
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+trace_sink = None
+
+# Prometheus metrics at /metrics (see metrics.py). Each worker process records
+# into its own file in HASH_METRICS_DIR and a scrape sums all of them, so the
+# totals cover every uvicorn worker. HASH_METRICS=0 turns recording off.
+HASH_METRICS = os.getenv("HASH_METRICS", "1") == "1"
+HASH_METRICS_DIR = os.getenv(
+    "HASH_METRICS_DIR", os.path.join(tempfile.gettempdir(), f"hash-metrics-{os.getenv('HASH_PORT', 8080)}"))
+# Difficulties from this one up share the last "difficulty" label
+METRICS_MAX_DIFFICULTY = int(os.getenv("METRICS_MAX_DIFFICULTY", 10))
+RESPONSE_STATUSES = (200, 499, 500, 503)
+CACHE_RESULTS = ("hit", "miss", "shared", "disabled")
+METRICS = MetricsSchema()
+M_REQUESTS = METRICS.counter("hash_requests_total", "Hash requests by response status", "status", RESPONSE_STATUSES)
+M_CACHE = METRICS.counter("hash_cache_lookups_total", "Hash results by cache outcome", "result", CACHE_RESULTS)
+M_COMPUTE = METRICS.histogram(
+    "hash_compute_seconds", "Time spent searching for a nonce, by difficulty", LATENCY_BUCKETS, "difficulty",
+    [*map(str, range(METRICS_MAX_DIFFICULTY)), f"{METRICS_MAX_DIFFICULTY}+"])
+M_QUEUE_WAIT = METRICS.histogram("hash_queue_wait_seconds", "Time spent waiting for a compute slot")
+M_DURATION = METRICS.histogram("hash_request_duration_seconds", "Time spent in the /hash handler")
+M_QUEUED = METRICS.gauge("hash_admission_queue_depth", "Requests waiting for a compute slot")
+M_POOL_JOBS = METRICS.gauge("hash_executor_jobs", "Hash tasks submitted to the executor and not finished yet")
+metrics = None
+
+class Overloaded(Exception):
+    """Raised when the admission queue is full."""
+
+def create_executor():
+    global search_best, free_search_slots, compute_slots
+    # A cancelled search keeps its slot until its chunks return, so allow for
+    # as many draining searches as running ones
+    search_best = multiprocessing.RawArray("q", 2 * COMPUTE_CAPACITY)
+    free_search_slots = list(range(2 * COMPUTE_CAPACITY))
+    compute_slots = asyncio.Semaphore(COMPUTE_CAPACITY)
+    lock = multiprocessing.Lock()
+    if HASH_TOPOLOGY == "process":
+        return ProcessPoolExecutor(
+            max_workers=NUM_CORES,
+            initializer=init_search_worker,
+            initargs=(search_best, lock),
+        )
+    # Threads and inline searches run in this process
+    init_search_worker(search_best, lock)
+    if HASH_TOPOLOGY == "thread":
+        # A single thread: this worker process owns one core
+        return ThreadPoolExecutor(max_workers=1)
+    return None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The executor is created per worker process at startup, not at import time
+    global pool, trace_sink, metrics
+    pool = create_executor()
+    trace_sink = open_sink(TRACE_LOG, "server")
+    if HASH_METRICS:
+        metrics = WorkerMetrics(METRICS, open_file_region(HASH_METRICS_DIR, METRICS))
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            # Counters stay in the file; this worker's gauges no longer apply
+            metrics.set(M_QUEUED, 0)
+            metrics.set(M_POOL_JOBS, 0)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+        if trace_sink is not None:
+            trace_sink.close()
+            trace_sink = None
+
+# Setup FastAPI; the executor is managed by the lifespan
+app = FastAPI(lifespan=lifespan)
 
 # Data model for the request
 class HashRequest(BaseModel):
@@ -26,41 +158,219 @@ def do_hashing(difficulty: int) -> str:
     Instead of a fixed number of hash iterations, this function finds a nonce such that
     the SHA-512 hash of (data + nonce) starts with a number of zeros equal to the difficulty.
     Increasing difficulty exponentially increases the CPU work required.
+
+    The search itself is done by pow_solver.solve, which hashes nonces in batches
+    from a precomputed hashlib state and returns the same nonce as a plain loop.
+    The endpoint runs the same search through pow_solver.solve_chunk so that it
+    can be split and cancelled.
     """
-    data = b"Hello, World!"
-    nonce = 0
-    target_prefix = "0" * difficulty  # e.g., if difficulty == 4, target_prefix = "0000"
-    
-    while True:
-        # Convert nonce to bytes and combine with data
-        combined = data + str(nonce).encode()
-        # Compute the SHA-512 hash
-        hash_result = hashlib.sha512(combined).hexdigest()
-        # Check if the hash meets the difficulty (i.e., has the required number of leading zeros)
-        if hash_result.startswith(target_prefix):
-            # Return both the nonce and the resulting hash for verification
-            return f"Nonce: {nonce}, Hash: {hash_result}"
-        nonce += 1
+    nonce, hash_result = solve(difficulty)
+    return format_result(nonce, hash_result)
+
+def format_result(nonce: int, hash_result: str) -> str:
+    # Return both the nonce and the resulting hash for verification
+    return f"Nonce: {nonce}, Hash: {hash_result}"
+
+def set_gauge(metric, value):
+    if metrics is not None:
+        metrics.set(metric, value)
+
+async def run_in_pool(fn, *args):
+    global pool_jobs
+    pool_jobs += 1
+    set_gauge(M_POOL_JOBS, pool_jobs)
+    try:
+        if pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    finally:
+        pool_jobs -= 1
+        set_gauge(M_POOL_JOBS, pool_jobs)
+
+def split_chunks(difficulty: int) -> int:
+    """Number of pool workers to spread this request over (1 means no split)."""
+    if not HASH_SPLIT or HASH_TOPOLOGY != "process" or difficulty < SPLIT_MIN_DIFFICULTY:
+        return 1
+    idle_workers = NUM_CORES - pool_jobs
+    return max(1, min(idle_workers, SPLIT_MAX_CHUNKS))
+
+async def admit() -> float:
+    """
+    Wait for a compute slot and return the time spent waiting.
+    Raises Overloaded right away if the queue is already full.
+    """
+    global queued
+    if compute_slots.locked() and queued >= HASH_QUEUE_DEPTH:
+        raise Overloaded()
+    queued += 1
+    set_gauge(M_QUEUED, queued)
+    wait_start = time.monotonic()
+    try:
+        await compute_slots.acquire()
+    finally:
+        queued -= 1
+        set_gauge(M_QUEUED, queued)
+    return time.monotonic() - wait_start
+
+async def compute_hash(difficulty: int) -> dict:
+    """
+    Admit the request and search the nonce space, split over several pool
+    workers when split_chunks allows it.
+
+    Chunks stop once another chunk has found a match in an earlier batch, and
+    the smallest nonce among the results is returned, so the answer is the same
+    as do_hashing's. If this coroutine is cancelled (client disconnected) the
+    chunks are told to stop at their next batch.
+    """
+    queue_wait = await admit()
+    compute_start = time.monotonic()
+    slot = free_search_slots.pop()
+    search_best[slot] = NO_MATCH
+    chunks = split_chunks(difficulty)
+    searches = asyncio.gather(
+        *(run_in_pool(solve_chunk, difficulty, offset, chunks, slot) for offset in range(chunks)),
+        return_exceptions=True,
+    )
+
+    def release(_=None):
+        free_search_slots.append(slot)
+        compute_slots.release()
+
+    try:
+        results = await asyncio.shield(searches)
+    except asyncio.CancelledError:
+        # Keep the slot and the compute permit until every chunk has returned
+        search_best[slot] = CANCELLED
+        searches.add_done_callback(release)
+        raise
+    release()
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    nonce, hash_result = min(result for result in results if result is not None)
+    return {
+        "result": format_result(nonce, hash_result),
+        "queue_wait": queue_wait,
+        "compute_time": time.monotonic() - compute_start,
+    }
+
+async def get_hash(difficulty: int):
+    """Return (computation, cache status), going through the cache when enabled."""
+    if hash_cache is None:
+        return await compute_hash(difficulty), "disabled"
+    computation, cache_status = await hash_cache.get_or_compute(difficulty, lambda: compute_hash(difficulty))
+    if cache_status == "hit":
+        computation = {**computation, "queue_wait": 0.0, "compute_time": 0.0}
+    return computation, cache_status
+
+async def until_disconnected(http_request: Request):
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+def record_metrics(difficulty, status, durations, cache_status):
+    if metrics is None:
+        return
+    metrics.inc(M_REQUESTS, RESPONSE_STATUSES.index(status))
+    metrics.observe(M_DURATION, durations["app"])
+    if cache_status is None:
+        return
+    metrics.inc(M_CACHE, CACHE_RESULTS.index(cache_status))
+    # Hits and shared results did not search themselves
+    if cache_status in ("miss", "disabled"):
+        metrics.observe(M_QUEUE_WAIT, durations["queue"])
+        metrics.observe(M_COMPUTE, durations["compute"], min(max(difficulty, 0), METRICS_MAX_DIFFICULTY))
+
+def trace(trace_id, difficulty, status, handler_start, computation=None, cache_status=None):
+    """Return this hop's Server-Timing value and record the request in the trace sink and metrics."""
+    durations = {}
+    if computation is not None:
+        durations["queue"] = computation["queue_wait"]
+        durations["compute"] = computation["compute_time"]
+    durations["app"] = time.monotonic() - handler_start
+    record_metrics(difficulty, status, durations, cache_status)
+    if trace_sink is not None:
+        trace_sink.record(
+            trace_id=trace_id, hop="server", time=time.time(), server=socket.gethostname(),
+            difficulty=difficulty, status=status, cache=cache_status,
+            **{f"{name}_ms": seconds * 1000 for name, seconds in durations.items()},
+        )
+    return server_timing(durations)
 
 # Asynchronous endpoint that offloads the CPU-bound task to the process pool
 @app.post("/hash")
-async def hash_endpoint(request: HashRequest):
+async def hash_endpoint(request: HashRequest, http_request: Request, response: Response):
     start_time = time.time()
-    loop = asyncio.get_running_loop()
-    # Offload CPU-bound task to the process pool
+    handler_start = time.monotonic()
+    trace_id = trace_id_from(http_request.headers)
+    # Offload CPU-bound task to the process pool, unless the result is cached.
+    # If the client goes away first, the queued or running work is cancelled.
+    work = asyncio.ensure_future(get_hash(request.difficulty))
+    watcher = asyncio.ensure_future(until_disconnected(http_request))
     try:
-        result = await loop.run_in_executor(pool, do_hashing, request.difficulty)
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not work.done():
+        work.cancel()
+        # Nobody is listening anymore; 499 is the de facto "client closed request"
+        trace(trace_id, request.difficulty, 499, handler_start)
+        return Response(status_code=499)
+
+    try:
+        computation, cache_status = work.result()
+    except Overloaded:
+        timing = trace(trace_id, request.difficulty, 503, handler_start)
+        return JSONResponse(
+            {"detail": "Server overloaded, admission queue is full"},
+            status_code=503,
+            headers={"Retry-After": str(HASH_RETRY_AFTER), "Server-Timing": timing, "X-Trace-Id": trace_id},
+        )
     except Exception as e:
+        trace(trace_id, request.difficulty, 500, handler_start)
         raise HTTPException(status_code=500, detail=str(e))
     end_time = time.time()
+    response.headers["Server-Timing"] = trace(trace_id, request.difficulty, 200, handler_start, computation, cache_status)
+    response.headers["X-Trace-Id"] = trace_id
     hostname = socket.gethostname()
     return {
         "start_time": start_time,
         "end_time": end_time,
-        "result": result,
-        "server": hostname
+        "queue_wait": computation["queue_wait"],
+        "compute_time": computation["compute_time"],
+        "result": computation["result"],
+        "server": hostname,
+        "cache": cache_status
     }
 
+@app.get("/cache")
+async def cache_stats_endpoint():
+    if hash_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **hash_cache.stats()}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (HASH_METRICS=0)")
+    return Response(render(METRICS, read_file_regions(HASH_METRICS_DIR, METRICS)), media_type=CONTENT_TYPE)
+
+# Lightweight liveness endpoint used by the load balancer health checks
+@app.get("/health")
+async def health_endpoint():
+    return {"status": "ok", "server": socket.gethostname()}
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("http_multi_core_server:app", host="0.0.0.0", port=8080, log_level="info", workers=NUM_CORES)
\ No newline at end of file
+    if HASH_METRICS:
+        reset_file_regions(HASH_METRICS_DIR)
+    uvicorn.run(
+        "http_multi_core_server:app",
+        host=os.getenv("HASH_HOST", "0.0.0.0"),
+        port=int(os.getenv("HASH_PORT", 8080)),
+        log_level="info",
+        workers=UVICORN_WORKERS,
+    )
\ No newline at end of file
@@ -1,9 +1,90 @@
 from sanic import Sanic, response
+from sanic.log import logger
 from sanic.request import Request
+import asyncio
 import httpx
 import json
+import math
+import os
+import random
+import time
+
+from health import BackendHealth
+from metrics import (CONTENT_TYPE, LATENCY_BUCKETS, MetricsSchema, WorkerMetrics, array_regions,
+                     local_region, render, render_family)
+from shared_state import SharedBackendState, create_shared_context
+from trace_sink import open_sink, server_timing, trace_id_from
 
 app = Sanic("LoadBalancer")
+# Agenda tarefas em segundo plano; o fast_proxy, que roda sem o Sanic, troca
+# por uma versão com asyncio puro
+add_task = app.add_task
+
+# Número de workers do Sanic ("auto" usa todos os núcleos). Com mais de um
+# worker a configuração e os contadores ficam em memória compartilhada.
+LB_WORKERS = os.getenv("LB_WORKERS", "1")
+LB_WORKERS = os.cpu_count() if LB_WORKERS == "auto" else int(LB_WORKERS)
+# Número máximo de servidores aceitos em /admin/config
+LB_MAX_BACKENDS = int(os.getenv("LB_MAX_BACKENDS", 64))
+
+# Pool de conexões keep-alive com cada servidor (por worker)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 100))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 10))
+# Tempo de espera antes de fechar o pool de um servidor removido da configuração
+UPSTREAM_CLOSE_GRACE = float(os.getenv("UPSTREAM_CLOSE_GRACE", UPSTREAM_TIMEOUT))
+
+# Modo de proxy: "json" injeta server_id no corpo; "passthrough" repassa o corpo
+# sem decodificar e identifica o servidor pelo header X-Server-Id
+PROXY_MODES = ("json", "passthrough")
+PROXY_MODE = os.getenv("PROXY_MODE", "json")
+
+# Headers hop-by-hop que não devem ser repassados ao cliente
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "content-length",
+}
+# Headers da resposta que o próprio LB define no lugar dos do servidor
+LB_RESPONSE_HEADERS = {"x-server-id", "x-trace-id", "server-timing"}
+
+# Sondagem ativa de saúde dos servidores
+HEALTH_CHECK_PATH = os.getenv("HEALTH_CHECK_PATH", "/health")
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 1))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 1))
+# Novas tentativas em outro servidor após erro de conexão ou timeout, enquanto
+# o tempo desde a chegada da requisição for menor que RETRY_BUDGET (s)
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 2))
+RETRY_BUDGET = float(os.getenv("RETRY_BUDGET", 2))
+
+# Prefixo dos arquivos de trace por requisição (ver trace_sink); vazio desativa
+# o arquivo, mas os tempos continuam no cabeçalho Server-Timing
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+trace_sink = None
+
+# Métricas no formato do Prometheus em /metrics (ver metrics.py); LB_METRICS=0
+# desativa a coleta, para medir o custo da instrumentação
+LB_METRICS = os.getenv("LB_METRICS", "1") == "1"
+# Séries por servidor são indexadas pelo slot (posição em SERVERS) e rotuladas
+# com o id do servidor que ocupa o slot no momento da coleta
+METRICS = MetricsSchema()
+M_UPSTREAM_REQUESTS = METRICS.counter(
+    "lb_upstream_requests_total", "Requests sent to each backend, retries included",
+    "backend", range(LB_MAX_BACKENDS))
+M_UPSTREAM_ERRORS = METRICS.counter(
+    "lb_upstream_errors_total", "Requests to each backend that failed with a connection error, timeout or 5xx",
+    "backend", range(LB_MAX_BACKENDS))
+M_UPSTREAM_LATENCY = METRICS.histogram(
+    "lb_upstream_latency_seconds", "Time from sending a request to a backend until its response",
+    LATENCY_BUCKETS, "backend", range(LB_MAX_BACKENDS))
+M_RESPONSES = METRICS.counter(
+    "lb_responses_total", "Responses sent to clients by status class",
+    "code", ("1xx", "2xx", "3xx", "4xx", "5xx"))
+M_REQUEST_DURATION = METRICS.histogram(
+    "lb_request_duration_seconds", "Time from arrival at the load balancer until the response")
+# Métricas deste worker e regiões de todos os workers, somadas em /metrics
+metrics = None
+metrics_regions = []
 
 # Lista de servidores, cada um com "host", "port", "weight" e "id".
 SERVERS = [
@@ -11,74 +92,778 @@ SERVERS = [
     {"host": "192.168.2.2", "port": 8080, "weight": 1, "id": 2},
 ]
 
-server_index = 0
+# Algoritmo de balanceamento inicial (ver STRATEGIES)
+ALGORITHM = os.getenv("LB_ALGORITHM", "round_robin")
+# Fator de suavização da média móvel exponencial de latência
+EWMA_ALPHA = float(os.getenv("EWMA_ALPHA", 0.3))
+# Latência assumida (s) para um servidor ainda sem amostras
+EWMA_INITIAL_LATENCY = float(os.getenv("EWMA_INITIAL_LATENCY", 0.001))
+
+# Modelo de custo das requisições POST /hash: cada dígito a mais de
+# dificuldade multiplica por ~16 os hashes necessários, então o trabalho
+# esperado é COST_BASE ** dificuldade (COST_BASE=1 conta só requisições).
+# Também pode ser alterado com "cost_base" em /admin/config.
+COST_BASE = float(os.getenv("COST_BASE", 16))
+HASH_PATH = "hash"
+# Dificuldades acima disso são recusadas no load balancer
+MAX_DIFFICULTY = int(os.getenv("MAX_DIFFICULTY", 10))
+
+def server_weight(srv):
+    return srv.get("weight", 1)
+
+def normalize_hash_body(body):
+    """
+    Lê a dificuldade do corpo de um POST /hash. Valores fracionários são
+    arredondados e negativos viram 0, e o corpo é reescrito nesses casos, para
+    que os servidores só recebam inteiros válidos.
+
+    :return: (corpo a encaminhar, dificuldade)
+    :raises ValueError: corpo malformado ou dificuldade inválida
+    """
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid JSON body")
+    if not isinstance(payload, dict) or "difficulty" not in payload:
+        raise ValueError("Missing 'difficulty'")
+    value = payload["difficulty"]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("'difficulty' must be a finite number")
+    difficulty = max(0, round(value))
+    if difficulty > MAX_DIFFICULTY:
+        raise ValueError(f"'difficulty' must be at most {MAX_DIFFICULTY}")
+    if type(value) is int and value == difficulty:
+        return body, difficulty
+    payload["difficulty"] = difficulty
+    return json.dumps(payload).encode(), difficulty
+
+def request_cost(difficulty):
+    return COST_BASE ** difficulty
+
+# Estado compartilhado entre workers (None quando LB_WORKERS == 1)
+shared_state = None
+# Versão da configuração aplicada neste worker
+config_version = 0
+# Requisições em andamento neste worker, por servidor
+in_flight = {}
+# Trabalho estimado (request_cost) em andamento e total despachado desde a
+# última mudança de configuração, por servidor
+work_in_flight = {}
+work_dispatched = {}
+
+def publish_in_flight(key):
+    if shared_state is not None and key in backend_slots:
+        slot = backend_slots[key]
+        shared_state.set_in_flight(slot, in_flight.get(key, 0))
+        shared_state.set_work(slot, work_in_flight.get(key, 0.0), work_dispatched.get(key, 0.0))
+
+def request_started(server, cost=1.0):
+    key = server_key(server)
+    in_flight[key] = in_flight.get(key, 0) + 1
+    work_in_flight[key] = work_in_flight.get(key, 0.0) + cost
+    work_dispatched[key] = work_dispatched.get(key, 0.0) + cost
+    publish_in_flight(key)
+
+def request_finished(server, cost=1.0):
+    key = server_key(server)
+    in_flight[key] = max(0, in_flight.get(key, 0) - 1)
+    # Zera ao esvaziar para não acumular erro de arredondamento dos floats
+    work_in_flight[key] = max(0.0, work_in_flight.get(key, 0.0) - cost) if in_flight[key] else 0.0
+    publish_in_flight(key)
+
+def outstanding(server):
+    """Requisições em andamento no servidor, somando todos os workers."""
+    key = server_key(server)
+    if shared_state is None:
+        return in_flight.get(key, 0)
+    slot = backend_slots.get(key)
+    return shared_state.total_in_flight(slot) if slot is not None else 0
+
+def outstanding_work(server):
+    """Trabalho estimado em andamento no servidor, somando todos os workers."""
+    key = server_key(server)
+    if shared_state is None:
+        return work_in_flight.get(key, 0.0)
+    slot = backend_slots.get(key)
+    return shared_state.total_work_in_flight(slot) if slot is not None else 0.0
+
+def dispatched_work(server):
+    key = server_key(server)
+    if shared_state is None:
+        return work_dispatched.get(key, 0.0)
+    slot = backend_slots.get(key)
+    return shared_state.total_work_dispatched(slot) if slot is not None else 0.0
+
+class BalancingStrategy:
+    """
+    Interface dos algoritmos de balanceamento.
+
+    Cada estratégia recebe a lista de servidores e escolhe um servidor por
+    requisição em select(), ignorando as chaves em "exclude" (servidores
+    ejetados ou já tentados); "cost" é o trabalho estimado da requisição
+    (request_cost). on_request_end() é chamado ao fim de cada
+    requisição para estratégias que aprendem com a latência observada.
+    """
+
+    def __init__(self, servers):
+        self.servers = []
+        self.update_servers(servers)
+
+    def update_servers(self, servers):
+        """Troca a lista de servidores preservando o estado dos que continuam."""
+        self.servers = [srv for srv in servers if server_weight(srv) > 0]
+
+    def select(self, exclude=(), cost=1.0):
+        raise NotImplementedError
+
+    def candidates(self, exclude):
+        if not exclude:
+            return self.servers
+        return [srv for srv in self.servers if server_key(srv) not in exclude]
+
+    def on_request_end(self, server, latency, failed):
+        pass
+
+    def load(self, server):
+        """Requisições em andamento normalizadas pelo peso do servidor."""
+        return outstanding(server) / server_weight(server)
+
+    def state(self):
+        return {str(srv["id"]): outstanding(srv) for srv in self.servers}
+
+class WeightedRoundRobinStrategy(BalancingStrategy):
+    """
+    Round robin ponderado suave (estilo nginx), O(número de servidores) por escolha.
+
+    A cada escolha todo servidor soma seu peso ao seu peso corrente; o de maior
+    peso corrente é escolhido e perde o peso total. Assim as requisições de um
+    servidor ficam intercaladas com as dos outros em vez de saírem em rajadas,
+    e os pesos podem ser fracionários.
+
+    Com vários workers os pesos correntes ficam em memória compartilhada
+    (um slot por servidor) e a escolha é feita sob lock.
+    """
+
+    def update_servers(self, servers):
+        previous = dict(zip(getattr(self, "keys", []), getattr(self, "current_weights", [])))
+        super().update_servers(servers)
+        self.keys = [server_key(srv) for srv in self.servers]
+        self.weights = [server_weight(srv) for srv in self.servers]
+        self.total_weight = sum(self.weights)
+        # Só reinicia a sequência se o conjunto de servidores mudou
+        if set(self.keys) == set(previous):
+            self.current_weights = [previous[key] for key in self.keys]
+        else:
+            self.current_weights = [0.0] * len(self.keys)
+        self.slots = [backend_slots.get(key, i) for i, key in enumerate(self.keys)]
+
+    def select(self, exclude=(), cost=1.0):
+        if shared_state is None:
+            return self.select_from(self.current_weights, range(len(self.weights)), exclude)
+        with shared_state.wrr_lock:
+            return self.select_from(shared_state.wrr_weights, self.slots, exclude)
+
+    def select_from(self, current_weights, slots, exclude):
+        # Como no nginx, servidores excluídos não participam da rodada e o
+        # peso total descontado é só o dos servidores considerados
+        best, best_weight, total_weight = -1, 0.0, 0.0
+        for i, slot in enumerate(slots):
+            if exclude and self.keys[i] in exclude:
+                continue
+            weight = self.weights[i]
+            total_weight += weight
+            current = current_weights[slot] + weight
+            current_weights[slot] = current
+            if best < 0 or current > best_weight:
+                best, best_weight = i, current
+        if best < 0:
+            return None
+        current_weights[slots[best]] -= total_weight
+        return self.servers[best]
+
+class LeastOutstandingStrategy(BalancingStrategy):
+    """Escolhe o servidor com menos requisições em andamento por unidade de peso."""
+
+    def select(self, exclude=(), cost=1.0):
+        servers = self.candidates(exclude)
+        if not servers:
+            return None
+        lowest = min(self.load(srv) for srv in servers)
+        # Empates são desfeitos aleatoriamente para não concentrar no primeiro da lista
+        return random.choice([srv for srv in servers if self.load(srv) == lowest])
+
+class PowerOfTwoChoicesStrategy(BalancingStrategy):
+    """Sorteia dois servidores e fica com o de menor carga em andamento."""
+
+    def select(self, exclude=(), cost=1.0):
+        servers = self.candidates(exclude)
+        if len(servers) < 2:
+            return servers[0] if servers else None
+        a, b = random.sample(servers, 2)
+        return a if self.load(a) <= self.load(b) else b
+
+class EwmaLatencyStrategy(BalancingStrategy):
+    """
+    Escolhe o servidor com menor custo esperado: latência média móvel
+    exponencial multiplicada pelas requisições em andamento (+1), dividida pelo peso.
+    Falhas contam como uma requisição que levou UPSTREAM_TIMEOUT.
+    """
+
+    def update_servers(self, servers):
+        previous = getattr(self, "ewma", {})
+        super().update_servers(servers)
+        self.ewma = {
+            server_key(srv): previous.get(server_key(srv), EWMA_INITIAL_LATENCY)
+            for srv in self.servers
+        }
+
+    def on_request_end(self, server, latency, failed):
+        key = server_key(server)
+        if key in self.ewma:
+            sample = max(latency, UPSTREAM_TIMEOUT) if failed else latency
+            self.ewma[key] += EWMA_ALPHA * (sample - self.ewma[key])
+
+    def cost(self, server):
+        return self.ewma[server_key(server)] * (outstanding(server) + 1) / server_weight(server)
+
+    def select(self, exclude=(), cost=1.0):
+        servers = self.candidates(exclude)
+        if not servers:
+            return None
+        lowest = min(self.cost(srv) for srv in servers)
+        return random.choice([srv for srv in servers if self.cost(srv) == lowest])
+
+    def state(self):
+        return {
+            str(srv["id"]): {
+                "in_flight": outstanding(srv),
+                "ewma_ms": round(self.ewma[server_key(srv)] * 1000, 3),
+            }
+            for srv in self.servers
+        }
+
+class LeastWorkStrategy(BalancingStrategy):
+    """
+    Escolhe o servidor em que o trabalho estimado em andamento, somado ao custo
+    desta requisição, fica menor por unidade de peso (núcleos). Assim uma
+    requisição de dificuldade alta pesa como as ~16^d requisições triviais que
+    ela equivale, em vez de contar como uma só.
+    """
+
+    def work_after(self, server, cost):
+        return (outstanding_work(server) + cost) / server_weight(server)
+
+    def select(self, exclude=(), cost=1.0):
+        servers = self.candidates(exclude)
+        if not servers:
+            return None
+        loads = [self.work_after(srv, cost) for srv in servers]
+        lowest = min(loads)
+        return random.choice([srv for srv, load in zip(servers, loads) if load == lowest])
+
+    def state(self):
+        return {
+            str(srv["id"]): {"in_flight": outstanding(srv), "outstanding_work": outstanding_work(srv)}
+            for srv in self.servers
+        }
+
+# "round_robin" e "balanced_round_robin" usam o mesmo algoritmo; o que muda
+# são os pesos enviados pelo automation_script.py
+STRATEGIES = {
+    "round_robin": WeightedRoundRobinStrategy,
+    "balanced_round_robin": WeightedRoundRobinStrategy,
+    "least_outstanding": LeastOutstandingStrategy,
+    "power_of_two": PowerOfTwoChoicesStrategy,
+    "ewma": EwmaLatencyStrategy,
+    "least_work": LeastWorkStrategy,
+}
+
+# Um httpx.AsyncClient por servidor, indexado por (host, port)
+upstream_clients = {}
+
+def server_key(srv):
+    return (srv["host"], srv["port"])
 
-def build_weighted_list(servers):
-    expanded = []
+def build_upstream_client(srv):
+    """Cria um cliente com pool de conexões persistentes para um servidor."""
+    limits = httpx.Limits(
+        max_connections=srv.get("max_connections", UPSTREAM_MAX_CONNECTIONS),
+        max_keepalive_connections=srv.get("max_keepalive", UPSTREAM_MAX_KEEPALIVE),
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        base_url=f"http://{srv['host']}:{srv['port']}",
+        limits=limits,
+        timeout=UPSTREAM_TIMEOUT,
+    )
+
+async def close_clients_later(clients, delay):
+    """Fecha os pools antigos depois que as requisições em andamento terminarem."""
+    await asyncio.sleep(delay)
+    for client in clients:
+        await client.aclose()
+
+def sync_upstream_clients(servers):
+    """
+    Reconstrói os pools a partir da lista de servidores.
+
+    Pools de servidores que continuam na lista são reaproveitados; os de
+    servidores removidos são fechados em segundo plano após UPSTREAM_CLOSE_GRACE.
+    """
+    global upstream_clients
+    new_clients = {}
+    for srv in servers:
+        key = server_key(srv)
+        if key not in new_clients:
+            new_clients[key] = upstream_clients.get(key) or build_upstream_client(srv)
+    removed = [c for k, c in upstream_clients.items() if k not in new_clients]
+    upstream_clients = new_clients
+    if removed:
+        add_task(close_clients_later(removed, UPSTREAM_CLOSE_GRACE))
+
+def get_upstream_client(server):
+    client = upstream_clients.get(server_key(server))
+    if client is None:
+        client = upstream_clients[server_key(server)] = build_upstream_client(server)
+    return client
+
+@app.main_process_start
+async def create_shared_state(app):
+    if LB_WORKERS > 1:
+        create_shared_context(app.shared_ctx, LB_WORKERS, LB_MAX_BACKENDS, current_config(), METRICS.size)
+
+def init_worker(shared_ctx=None):
+    """
+    Prepara o estado de um processo do load balancer: trace, estado
+    compartilhado (se shared_ctx for dado), métricas, pools e circuit breakers.
+    """
+    global shared_state, trace_sink, metrics, metrics_regions
+    trace_sink = open_sink(TRACE_LOG, "lb")
+    if shared_ctx is not None:
+        shared_state = SharedBackendState(shared_ctx, LB_WORKERS, LB_MAX_BACKENDS)
+        refresh_config()
+    if LB_METRICS:
+        if shared_state is not None:
+            metrics_regions = array_regions(shared_state.metrics, METRICS)
+            metrics = WorkerMetrics(METRICS, metrics_regions[shared_state.worker_slot])
+        else:
+            metrics_regions = [local_region(METRICS)]
+            metrics = WorkerMetrics(METRICS, metrics_regions[0])
+    sync_upstream_clients(SERVERS)
+    sync_backend_health(SERVERS)
+
+@app.before_server_start
+async def open_upstream_clients(app):
+    init_worker(app.shared_ctx if LB_WORKERS > 1 else None)
+    app.add_task(health_check_loop())
+
+@app.after_server_stop
+async def close_upstream_clients(app):
+    global upstream_clients, trace_sink
+    clients, upstream_clients = list(upstream_clients.values()), {}
+    for client in clients:
+        await client.aclose()
+    if trace_sink is not None:
+        trace_sink.close()
+        trace_sink = None
+
+# Circuit breaker de cada servidor neste worker, indexado por (host, port)
+backend_health = {}
+
+def sync_backend_health(servers):
+    global backend_health
+    backend_health = {
+        server_key(srv): backend_health.get(server_key(srv)) or BackendHealth() for srv in servers
+    }
+
+def record_upstream_result(server, failed):
+    health = backend_health.get(server_key(server))
+    if health is not None:
+        if failed:
+            health.record_failure()
+        else:
+            health.record_success()
+
+async def probe_server(server):
+    try:
+        r = await get_upstream_client(server).get(HEALTH_CHECK_PATH, timeout=HEALTH_CHECK_TIMEOUT)
+        return r.status_code < 500
+    except httpx.RequestError:
+        return False
+
+async def health_check_loop():
+    """
+    Sonda periodicamente os servidores que não estão ejetados. Um erro numa
+    rodada é registrado e a sondagem continua: servidores em half-open só
+    voltam por aqui.
+    """
+    while True:
+        try:
+            servers = [
+                srv for srv in SERVERS
+                if server_key(srv) in backend_health and backend_health[server_key(srv)].should_probe()
+            ]
+            results = await asyncio.gather(*(probe_server(srv) for srv in servers))
+            for srv, ok in zip(servers, results):
+                record_upstream_result(srv, not ok)
+        except Exception:
+            logger.exception("Health check round failed")
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+def build_backend_slots(servers):
+    slots = {}
     for srv in servers:
-        weight = srv.get("weight", 1)
-        expanded.extend([srv] * weight)
-    return expanded
+        slots.setdefault(server_key(srv), len(slots))
+    return slots
+
+def active_slots():
+    return {server_key(srv): backend_slots[server_key(srv)] for srv in balancer.servers}
+
+# Posição de cada servidor em SERVERS, usada como índice na memória compartilhada
+backend_slots = build_backend_slots(SERVERS)
+balancer = STRATEGIES[ALGORITHM](SERVERS)
+
+def current_config():
+    return {"servers": SERVERS, "proxy_mode": PROXY_MODE, "algorithm": ALGORITHM, "cost_base": COST_BASE}
+
+def is_number(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+
+def validate_server(srv):
+    """Retorna uma mensagem de erro ou None se a entrada de servidor for válida."""
+    if not isinstance(srv, dict) or any(field not in srv for field in ("host", "port", "id", "weight")):
+        return "Invalid server, expected an object with host, port, id and weight"
+    if not isinstance(srv["host"], str) or not srv["host"]:
+        return "Invalid server host, expected a non-empty string"
+    if isinstance(srv["port"], bool) or not isinstance(srv["port"], int) or not 0 < srv["port"] < 65536:
+        return "Invalid server port, expected an integer between 1 and 65535"
+    if not isinstance(srv["id"], (int, str)) or isinstance(srv["id"], bool):
+        return "Invalid server id, expected an integer or a string"
+    if not is_number(srv["weight"]) or srv["weight"] < 0:
+        return "Invalid server weight, expected a number >= 0"
+    return None
+
+def validate_config(config_data):
+    """Retorna uma mensagem de erro ou None se a configuração for válida."""
+    if not isinstance(config_data, dict):
+        return "Invalid config, expected a JSON object"
+    servers = config_data.get("servers", SERVERS)
+    if not isinstance(servers, list):
+        return "Invalid servers, expected a list"
+    for srv in servers:
+        error = validate_server(srv)
+        if error:
+            return error
+    if config_data.get("algorithm", ALGORITHM) not in STRATEGIES:
+        return f"Invalid algorithm, expected one of {list(STRATEGIES)}"
+    if config_data.get("proxy_mode", PROXY_MODE) not in PROXY_MODES:
+        return f"Invalid proxy_mode, expected one of {list(PROXY_MODES)}"
+    if len(servers) > LB_MAX_BACKENDS:
+        return f"Too many servers, at most {LB_MAX_BACKENDS} are supported"
+    cost_base = config_data.get("cost_base", COST_BASE)
+    if not is_number(cost_base) or not 1 <= cost_base <= 1e6:
+        return "Invalid cost_base, expected a number between 1 and 1e6"
+    return None
+
+def apply_config(config_data):
+    """
+    Aplica uma configuração já validada por validate_config neste worker; com
+    a validação nada aqui falha no meio, deixando a configuração pela metade.
+    """
+    global SERVERS, PROXY_MODE, ALGORITHM, COST_BASE, balancer, backend_slots
+    servers = config_data.get("servers", SERVERS)
+    algorithm = config_data.get("algorithm", ALGORITHM)
+    slots = build_backend_slots(servers)
+
+    # As estratégias consultam backend_slots ao receber a lista de servidores.
+    # Requisições em andamento terminam na estratégia antiga, que as iniciou.
+    backend_slots = slots
+    if algorithm != ALGORITHM:
+        balancer = STRATEGIES[algorithm](servers)
+    else:
+        balancer.update_servers(servers)
+    SERVERS, ALGORITHM = servers, algorithm
+    PROXY_MODE = config_data.get("proxy_mode", PROXY_MODE)
+    COST_BASE = float(config_data.get("cost_base", COST_BASE))
+    # A divisão de trabalho reportada vale a partir de cada nova configuração
+    work_dispatched.clear()
+    if shared_state is not None:
+        shared_state.clear_row()
+        for key in backend_slots:
+            publish_in_flight(key)
+    sync_upstream_clients(SERVERS)
+    sync_backend_health(SERVERS)
+
+def refresh_config():
+    """Recarrega a configuração compartilhada se outro worker a alterou."""
+    global config_version
+    if shared_state is not None and shared_state.version() != config_version:
+        config_version, config_data = shared_state.read_config()
+        apply_config(config_data)
 
-servers_weighted_list = build_weighted_list(SERVERS)
+def get_next_server(tried=(), cost=1.0):
+    """
+    Escolhe um servidor saudável que ainda não foi tentado para esta requisição.
+    Se todos os servidores não tentados estiverem ejetados, ignora a saúde
+    (fail open) em vez de recusar a requisição.
+    """
+    now = time.monotonic()
+    unavailable = {key for key, health in backend_health.items() if not health.available(now)}
+    unavailable.update(tried)
+    return balancer.select(unavailable, cost) or balancer.select(set(tried), cost)
 
-def get_next_server():
-    global server_index, servers_weighted_list
-    if not servers_weighted_list:
-        return None
-    server = servers_weighted_list[server_index]
-    server_index = (server_index + 1) % len(servers_weighted_list)
-    return server
+def work_report():
+    """Trabalho estimado em andamento e parcela do total despachado de cada servidor."""
+    dispatched = {str(srv["id"]): dispatched_work(srv) for srv in SERVERS}
+    total = sum(dispatched.values())
+    return {
+        str(srv["id"]): {
+            "outstanding_work": outstanding_work(srv),
+            "dispatched_work": dispatched[str(srv["id"])],
+            "work_share": dispatched[str(srv["id"])] / total if total else 0.0,
+        }
+        for srv in SERVERS
+    }
+
+def record_attempt(server, latency, failed):
+    slot = backend_slots.get(server_key(server))
+    if metrics is None or slot is None:
+        return
+    metrics.inc(M_UPSTREAM_REQUESTS, slot)
+    if failed:
+        metrics.inc(M_UPSTREAM_ERRORS, slot)
+    metrics.observe(M_UPSTREAM_LATENCY, latency, slot)
+
+def record_response(status, duration):
+    if metrics is None:
+        return
+    metrics.inc(M_RESPONSES, min(max(status // 100, 1), 5) - 1)
+    metrics.observe(M_REQUEST_DURATION, duration)
+
+def config_response(**extra):
+    return response.json({
+        **extra,
+        "servers": SERVERS,
+        "proxy_mode": PROXY_MODE,
+        "algorithm": ALGORITHM,
+        "cost_base": COST_BASE,
+        "balancer_state": balancer.state(),
+        "work": work_report(),
+        "health": {
+            str(srv["id"]): backend_health[server_key(srv)].describe()
+            for srv in SERVERS if server_key(srv) in backend_health
+        },
+    })
 
 @app.route("/admin/config", methods=["GET"])
 async def get_config(request: Request):
-    return response.json({"servers": SERVERS})
+    refresh_config()
+    return config_response()
 
 @app.route("/admin/config", methods=["POST"])
 async def update_config(request: Request):
-    global SERVERS, servers_weighted_list, server_index
+    global config_version
     config_data = request.json
-    if "servers" in config_data:
-        SERVERS = config_data["servers"]
+    error = validate_config(config_data)
+    if error:
+        return response.json({"error": error}, status=400)
+
+    refresh_config()
+    old_slots = active_slots()
+    apply_config(config_data)
+    if shared_state is not None:
+        config_version = shared_state.publish_config(current_config(), old_slots, active_slots())
+
+    return config_response(status="config_updated")
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request):
+    if metrics is None:
+        return response.json({"error": "Metrics are disabled (LB_METRICS=0)"}, status=404)
+    refresh_config()
+    now = time.monotonic()
+    backend_labels = [None] * LB_MAX_BACKENDS
+    # Valores que já existem no estado do balanceador são lidos na hora da coleta
+    in_flight_samples, work_samples, available_samples = [], [], []
+    for srv in SERVERS:
+        key = server_key(srv)
+        backend_labels[backend_slots[key]] = str(srv["id"])
+        label = (("backend", str(srv["id"])),)
+        health = backend_health.get(key)
+        in_flight_samples.append((label, outstanding(srv)))
+        work_samples.append((label, outstanding_work(srv)))
+        available_samples.append((label, int(health is None or health.available(now))))
+
+    body = render(METRICS, metrics_regions, {"backend": backend_labels})
+    body += render_family("lb_upstream_in_flight", "gauge", "Requests in progress on each backend",
+                          in_flight_samples)
+    body += render_family("lb_upstream_outstanding_work", "gauge",
+                          "Estimated work (COST_BASE ** difficulty) in progress on each backend", work_samples)
+    body += render_family("lb_backend_available", "gauge",
+                          "Whether this worker's circuit breaker lets requests through", available_samples)
+    return response.text(body, content_type=CONTENT_TYPE)
+
+@app.on_request
+async def mark_arrival(request: Request):
+    request.ctx.arrival = time.monotonic()
+
+class RequestTrace:
+    """
+    Tempos (s, relógio monotônico) de uma requisição dentro do load balancer:
+    lb_queue (chegada até a primeira escolha de servidor), lb_select (escolha),
+    upstream_wait (espera por conexão livre no pool), upstream_connect (abertura
+    de conexão nova) e upstream (envio até a resposta do servidor). Com novas
+    tentativas os tempos de todas elas são somados.
+    """
+
+    def __init__(self, trace_id, arrival):
+        self.trace_id = trace_id
+        self.arrival = arrival
+        self.durations = {"lb_queue": 0.0, "lb_select": 0.0, "upstream_wait": 0.0,
+                          "upstream_connect": 0.0, "upstream": 0.0}
+        self.attempts = 0
+        self.status = None
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(trace_id_from(request.headers), getattr(request.ctx, "arrival", time.monotonic()))
+
+    def httpx_hook(self):
+        """Extensão "trace" do httpx: guarda o instante de cada evento da conexão."""
+        events = {}
+
+        async def hook(name, info):
+            events[name] = time.monotonic()
 
-    servers_weighted_list = build_weighted_list(SERVERS)
-    server_index = 0
+        return events, hook
 
-    return response.json({"status": "config_updated", "servers": SERVERS})
+    def add_upstream(self, events, sent, done):
+        connect = 0.0
+        if "connection.connect_tcp.started" in events:
+            connected = events.get("connection.start_tls.complete") or events.get("connection.connect_tcp.complete", done)
+            connect = connected - events["connection.connect_tcp.started"]
+        headers_sent = events.get("http11.send_request_headers.started", sent)
+        self.durations["upstream_connect"] += connect
+        self.durations["upstream_wait"] += max(0.0, headers_sent - sent - connect)
+        self.durations["upstream"] += done - headers_sent
+
+    def header(self, upstream_timing=None):
+        timing = server_timing(self.durations)
+        return f"{timing}, {upstream_timing}" if upstream_timing else timing
+
+    def finish(self, server, status):
+        total = time.monotonic() - self.arrival
+        record_response(status, total)
+        if trace_sink is None:
+            return
+        trace_sink.record(
+            trace_id=self.trace_id, hop="lb", time=time.time(), server_id=server["id"] if server else None,
+            status=status, attempts=self.attempts, total_ms=total * 1000,
+            **{f"{name}_ms": seconds * 1000 for name, seconds in self.durations.items()},
+        )
 
 @app.route("/<path:path>", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"])
 async def proxy_request(request: Request, path: str):
-    server = get_next_server()
-    if not server:
-        return response.json({"error": "No servers configured"}, status=503)
+    trace = RequestTrace.from_request(request)
+    refresh_config()
+    received = time.monotonic()
+    trace.durations["lb_queue"] = received - trace.arrival
+    tried = set()
+
+    # O custo de um /hash vem da dificuldade no corpo; entradas inválidas param aqui
+    body, cost = request.body, 1.0
+    if path == HASH_PATH and request.method == "POST":
+        try:
+            body, difficulty = normalize_hash_body(body)
+        except ValueError as e:
+            trace.finish(None, 400)
+            return response.json({"error": str(e)}, status=400, headers={"X-Trace-Id": trace.trace_id})
+        cost = request_cost(difficulty)
+
+    while True:
+        strategy = balancer
+        select_start = time.monotonic()
+        server = get_next_server(tried, cost)
+        trace.durations["lb_select"] += time.monotonic() - select_start
+        if not server:
+            if tried:
+                break
+            trace.finish(None, 503)
+            return response.json({"error": "No servers configured"}, status=503,
+                                 headers={"X-Trace-Id": trace.trace_id, "Server-Timing": trace.header()})
+        tried.add(server_key(server))
+        trace.attempts += 1
+
+        request_started(server, cost)
+        started = time.monotonic()
+        failed = True
+        try:
+            result, failed = await forward_to_server(request, path, server, trace, body)
+            record_upstream_result(server, False)
+            trace.finish(server, trace.status)
+            return result
+        except httpx.RequestError as e:
+            record_upstream_result(server, True)
+            error, failed_server = e, server
+        finally:
+            request_finished(server, cost)
+            latency = time.monotonic() - started
+            strategy.on_request_end(server, latency, failed)
+            record_attempt(server, latency, failed)
+
+        # Erro de conexão ou timeout: tenta outro servidor se ainda houver orçamento
+        if len(tried) > MAX_RETRIES or time.monotonic() - received >= RETRY_BUDGET:
+            break
 
-    target_url = f"http://{server['host']}:{server['port']}/{path}"
+    trace.finish(failed_server, 502)
+    return response.json(
+        {"error": f"Failed to connect to upstream server: {error}", "server_id": failed_server["id"]},
+        status=502,
+        headers={"X-Trace-Id": trace.trace_id, "Server-Timing": trace.header()},
+    )
+
+async def forward_to_server(request, path, server, trace, content):
+    """
+    Encaminha a requisição ao servidor escolhido.
+
+    :return: tupla (resposta, falhou), onde falhou indica status 5xx
+    :raises httpx.RequestError: se não foi possível obter resposta do servidor
+    """
+    target_url = f"/{path}"
     method = request.method
 
     # Copy headers and remove 'host'
     headers = dict(request.headers)
     headers.pop("host", None)
+    headers["x-trace-id"] = trace.trace_id
+    if content is not request.body:
+        # Corpo reescrito por normalize_hash_body; o httpx recalcula o tamanho
+        headers.pop("content-length", None)
 
     # Convert Sanic request.args to a standard dict
     params = dict(request.args)
 
-    # Request body
-    content = request.body
+    client = get_upstream_client(server)
+    events, hook = trace.httpx_hook()
+    upstream_request = client.build_request(
+        method=method,
+        url=target_url,
+        headers=headers,
+        params=params,
+        content=content,
+        extensions={"trace": hook},
+    )
+    stream = PROXY_MODE == "passthrough"
 
+    sent = time.monotonic()
     try:
-        async with httpx.AsyncClient() as client:
-            upstream_response = await client.request(
-                method=method,
-                url=target_url,
-                headers=headers,
-                params=params,
-                content=content,
-            )
-    except httpx.RequestError as e:
-        return response.json(
-            {"error": f"Failed to connect to upstream server: {e}", "server_id": server["id"]},
-            status=502,
-        )
+        upstream_response = await client.send(upstream_request, stream=stream)
+    finally:
+        trace.add_upstream(events, sent, time.monotonic())
+    trace.status = upstream_response.status_code
+    failed = upstream_response.status_code >= 500
+    if stream:
+        return await stream_upstream_response(request, upstream_response, server, trace), failed
 
     try:
         response_data = upstream_response.json()
@@ -86,7 +871,44 @@ async def proxy_request(request: Request, path: str):
         response_data = {"error": "Invalid JSON response from server"}
 
     response_data["server_id"] = server["id"]
-    return response.json(response_data, status=upstream_response.status_code)
+    return response.json(
+        response_data,
+        status=upstream_response.status_code,
+        headers={
+            "X-Server-Id": str(server["id"]),
+            "X-Trace-Id": trace.trace_id,
+            "Server-Timing": trace.header(upstream_response.headers.get("server-timing")),
+        },
+    ), failed
+
+async def stream_upstream_response(request, upstream_response, server, trace):
+    """Repassa status, headers e corpo do servidor em blocos, sem decodificar o JSON."""
+    # Os headers que o LB define substituem os do servidor, sem duplicar
+    headers = {
+        k: v for k, v in upstream_response.headers.items()
+        if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in LB_RESPONSE_HEADERS
+    }
+    headers["X-Server-Id"] = str(server["id"])
+    headers["X-Trace-Id"] = trace.trace_id
+    headers["Server-Timing"] = trace.header(upstream_response.headers.get("server-timing"))
+    content_type = headers.pop("content-type", None)
+    try:
+        client_response = await request.respond(
+            status=upstream_response.status_code,
+            headers=headers,
+            content_type=content_type,
+        )
+        # aiter_raw preserva o content-encoding original do servidor
+        try:
+            async for chunk in upstream_response.aiter_raw():
+                await client_response.send(chunk)
+        except httpx.RequestError:
+            # A resposta já começou a ser enviada, então não há como tentar outro
+            # servidor; o cliente recebe o corpo truncado
+            pass
+        await client_response.eof()
+    finally:
+        await upstream_response.aclose()
 
 
 # Para capturar a rota raiz "/"
@@ -95,5 +917,8 @@ async def root_proxy(request: Request):
     return await proxy_request(request, path="")
 
 if __name__ == "__main__":
-    # Rodando com um único worker
-    app.run(host="0.0.0.0", port=8080, workers=1)
+    app.run(
+        host=os.getenv("LB_HOST", "0.0.0.0"),
+        port=int(os.getenv("LB_PORT", 8080)),
+        workers=LB_WORKERS,
+    )
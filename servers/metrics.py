@@ -0,0 +1,179 @@
+"""
+Prometheus metrics kept in flat arrays of doubles, one region per worker process.
+
+A MetricsSchema gives every metric a fixed offset: one slot per label value for
+counters and gauges, and for histograms one slot per bucket plus +Inf and the
+sum. Each worker writes only its own region (a row of a shared RawArray in the
+load balancer, a small mmap'd file per uvicorn worker in the hashing server),
+so recording a value is one or two float additions with no lock and no
+allocation. A scrape sums the regions of all workers and renders the
+Prometheus text format. A read that races with a write can miss the request
+in progress, which is fine for monitoring.
+"""
+import bisect
+import glob
+import mmap
+import os
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Latency buckets (s), from a cache hit to a high-difficulty search
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DOUBLE_SIZE = 8
+REGION_SUFFIX = ".metrics"
+
+
+class Metric:
+    """A metric family with a fixed list of label values (a single series without a label)."""
+
+    def __init__(self, kind, name, help_text, label=None, values=(), buckets=()):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = [str(value) for value in values] if label else [""]
+        self.buckets = tuple(buckets)
+        # Histograms: one slot per bucket, one for +Inf and one for the sum
+        self.width = len(self.buckets) + 2 if kind == "histogram" else 1
+        self.offset = 0
+
+    @property
+    def size(self):
+        return self.width * len(self.values)
+
+
+class MetricsSchema:
+    def __init__(self):
+        self.metrics = []
+        self.size = 0
+
+    def add(self, metric):
+        metric.offset = self.size
+        self.size += metric.size
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label=None, values=()):
+        return self.add(Metric("counter", name, help_text, label, values))
+
+    def gauge(self, name, help_text, label=None, values=()):
+        """A gauge summed over workers, e.g. each worker's own queue depth."""
+        return self.add(Metric("gauge", name, help_text, label, values))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, label=None, values=()):
+        return self.add(Metric("histogram", name, help_text, label, values, buckets))
+
+
+class WorkerMetrics:
+    """
+    Recording side: this worker's region of a schema. "index" is the position
+    of the label value in the metric's values.
+    """
+
+    def __init__(self, schema, region):
+        self.schema = schema
+        self.values = region
+
+    def inc(self, metric, index=0, amount=1.0):
+        self.values[metric.offset + index] += amount
+
+    def set(self, metric, value, index=0):
+        self.values[metric.offset + index] = value
+
+    def observe(self, metric, value, index=0):
+        base = metric.offset + index * metric.width
+        self.values[base + bisect.bisect_left(metric.buckets, value)] += 1
+        self.values[base + metric.width - 1] += value
+
+
+def local_region(schema):
+    """A region for a single process, with nothing to share."""
+    return memoryview(bytearray(schema.size * DOUBLE_SIZE)).cast("d")
+
+
+def array_regions(array, schema):
+    """Split a RawArray("d") of workers * schema.size doubles into one region per worker."""
+    view = memoryview(array).cast("B").cast("d")
+    return [view[start:start + schema.size] for start in range(0, len(view), schema.size)]
+
+
+def open_file_region(directory, schema):
+    """
+    Create this process's region as <directory>/<pid>.metrics, mapped in memory,
+    for servers whose workers share nothing but the file system.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}{REGION_SUFFIX}")
+    with open(path, "wb") as f:
+        f.write(bytes(schema.size * DOUBLE_SIZE))
+    with open(path, "r+b") as f:
+        mapped = mmap.mmap(f.fileno(), schema.size * DOUBLE_SIZE)
+    return memoryview(mapped).cast("d")
+
+
+def read_file_regions(directory, schema):
+    """Snapshot of every worker's region in directory; files from another schema are skipped."""
+    regions = []
+    for path in glob.glob(os.path.join(directory, f"*{REGION_SUFFIX}")):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        if len(data) == schema.size * DOUBLE_SIZE:
+            regions.append(memoryview(data).cast("d"))
+    return regions
+
+
+def reset_file_regions(directory):
+    """Remove the regions of a previous run (call before starting the workers)."""
+    for path in glob.glob(os.path.join(directory, f"*{REGION_SUFFIX}")):
+        os.remove(path)
+
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def format_labels(*pairs):
+    labels = ",".join(f'{name}="{value}"' for name, value in pairs if name)
+    return f"{{{labels}}}" if labels else ""
+
+
+def render_family(name, kind, help_text, samples):
+    """Text for a family computed at scrape time; samples are (label pairs, value)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{format_labels(*labels)} {format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+def render(schema, regions, relabel=None):
+    """
+    Sum the regions and render them in the Prometheus text format.
+
+    :param relabel: Optional {label name: values} replacing the schema's label
+                    values at scrape time; series whose value is None are omitted
+    """
+    totals = [sum(column) for column in zip(*regions)] if regions else [0.0] * schema.size
+    relabel = relabel or {}
+    lines = []
+    for metric in schema.metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        values = relabel.get(metric.label, metric.values)
+        for index, value in enumerate(values[:len(metric.values)]):
+            if value is None:
+                continue
+            label = (metric.label, value)
+            base = metric.offset + index * metric.width
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{format_labels(label)} {format_value(totals[base])}")
+                continue
+            count = 0.0
+            for bucket, le in enumerate(metric.buckets + ("+Inf",)):
+                count += totals[base + bucket]
+                lines.append(f"{metric.name}_bucket{format_labels(label, ('le', le))} {format_value(count)}")
+            lines.append(f"{metric.name}_sum{format_labels(label)} {format_value(totals[base + metric.width - 1])}")
+            lines.append(f"{metric.name}_count{format_labels(label)} {format_value(count)}")
+    return "\n".join(lines) + "\n"
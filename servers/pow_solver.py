@@ -0,0 +1,146 @@
+"""
+Proof-of-work solver engines for the hashing server.
+
+The search finds the smallest nonce such that SHA-512(DATA + str(nonce)) has
+`difficulty` leading zero hex digits. Instead of building, hashing and
+hex-encoding a fresh byte string per nonce, the fast engine:
+
+- keeps a hashlib state with DATA (and the high decimal digits of the nonce)
+  already absorbed and only .copy()/.update() the remaining digits,
+- walks nonces in batches of BATCH_SIZE that share their high digits, so the
+  low digits come from a precomputed table,
+- checks the raw digest with a single bytes comparison against a threshold
+  instead of hexdigest() + startswith().
+
+Nonces are visited in increasing order, so the result is identical to the
+reference loop.
+"""
+import hashlib
+
+DATA = b"Hello, World!"
+BATCH_DIGITS = 3
+BATCH_SIZE = 10 ** BATCH_DIGITS
+# Zero-padded low digits shared by every batch after the first one
+_LOW_DIGITS = [b"%0*d" % (BATCH_DIGITS, i) for i in range(BATCH_SIZE)]
+
+
+def difficulty_target(difficulty):
+    """
+    Return the 64-byte threshold below which a SHA-512 digest has at least
+    `difficulty` leading zero hex digits, or None if any digest qualifies.
+    """
+    if difficulty <= 0:
+        return None
+    if difficulty >= 128:
+        return bytes(64)
+    return (16 ** (128 - difficulty)).to_bytes(64, "big")
+
+
+def search_batch(prefix_state, batch, target):
+    """
+    Search nonces batch*BATCH_SIZE .. (batch+1)*BATCH_SIZE - 1 in order.
+
+    :param prefix_state: hashlib.sha512 state that already absorbed DATA
+    :return: (nonce, hexdigest) of the first match, or None
+    """
+    if batch == 0:
+        # Nonces below BATCH_SIZE are not zero-padded, so they can't share a prefix
+        for nonce in range(BATCH_SIZE):
+            h = prefix_state.copy()
+            h.update(b"%d" % nonce)
+            if h.digest() < target:
+                return nonce, h.hexdigest()
+        return None
+
+    base = prefix_state.copy()
+    base.update(b"%d" % batch)
+    copy = base.copy
+    for low, digits in enumerate(_LOW_DIGITS):
+        h = copy()
+        h.update(digits)
+        if h.digest() < target:
+            return batch * BATCH_SIZE + low, h.hexdigest()
+    return None
+
+
+def solve(difficulty, first_batch=0, stride=1, stop_batch=None):
+    """
+    Find the smallest matching nonce among batches first_batch, first_batch + stride, ...
+
+    :param stop_batch: Stop before this batch index (None searches forever)
+    :return: (nonce, hexdigest), or None if no batch in the range matches
+    """
+    target = difficulty_target(difficulty)
+    if target is None:
+        return 0, hashlib.sha512(DATA + b"0").hexdigest()
+
+    prefix_state = hashlib.sha512(DATA)
+    batch = first_batch
+    while stop_batch is None or batch < stop_batch:
+        found = search_batch(prefix_state, batch, target)
+        if found is not None:
+            return found
+        batch += stride
+    return None
+
+
+def solve_reference(difficulty):
+    """The original one-hash-per-iteration loop, kept for verification and benchmarks."""
+    nonce = 0
+    target_prefix = "0" * difficulty
+    while True:
+        hash_result = hashlib.sha512(DATA + str(nonce).encode()).hexdigest()
+        if hash_result.startswith(target_prefix):
+            return nonce, hash_result
+        nonce += 1
+
+
+# Shared state for searches run on pool workers, set by init_search_worker
+NO_MATCH = 2 ** 63 - 1
+CANCELLED = -1
+_search_best = None
+_search_lock = None
+
+
+def init_search_worker(best, lock):
+    """
+    Executor initializer for solve_chunk.
+
+    :param best: multiprocessing RawArray("q") with one slot per concurrent search,
+                 holding the earliest batch where a match was found (NO_MATCH if
+                 none yet, CANCELLED to stop the search)
+    :param lock: multiprocessing.Lock guarding updates to best
+    """
+    global _search_best, _search_lock
+    _search_best, _search_lock = best, lock
+
+
+def solve_chunk(difficulty, offset, stride, slot):
+    """
+    Search batches offset, offset + stride, ... for one request.
+
+    With stride 1 this is the plain sequential search. With several chunks of
+    the same request (split search), a chunk stops as soon as its next batch is
+    past the earliest batch where any chunk found a match, since it can no
+    longer find a smaller nonce. The smallest nonce among the chunk results is
+    therefore the same one the sequential search returns. Setting the slot to
+    CANCELLED stops every chunk at its next batch.
+
+    :return: (nonce, hexdigest) or None
+    """
+    target = difficulty_target(difficulty)
+    if target is None:
+        return solve(difficulty) if offset == 0 else None
+
+    prefix_state = hashlib.sha512(DATA)
+    best = _search_best
+    batch = offset
+    while batch < best[slot]:
+        found = search_batch(prefix_state, batch, target)
+        if found is not None:
+            with _search_lock:
+                if batch < best[slot]:
+                    best[slot] = batch
+            return found
+        batch += stride
+    return None
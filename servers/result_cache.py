@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with a TTL for results of async computations.
+
+    Concurrent lookups of a key that is not cached yet share a single
+    computation: the first caller starts it as a task and later callers await
+    the same task. Waiters await it through asyncio.shield, so a caller that
+    goes away does not cancel the computation for the others; the computation
+    is only cancelled when its last waiter is cancelled.
+    """
+
+    def __init__(self, max_entries, ttl):
+        """
+        :param max_entries: Maximum number of cached results (least recently used are evicted)
+        :param ttl: Seconds a result stays valid (0 or less means no expiry)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.in_flight = {}  # key -> asyncio.Task
+        self.waiters = {}  # asyncio.Task -> number of callers awaiting it
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.expired = 0
+        self.evictions = 0
+
+    async def get_or_compute(self, key, compute):
+        """
+        Return (value, status) where status is "hit", "miss" or "shared".
+
+        :param compute: Zero-argument coroutine function producing the value
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value, "hit"
+            del self.entries[key]
+            self.expired += 1
+
+        task = self.in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            status = "miss"
+            task = self.in_flight[key] = asyncio.ensure_future(self._compute(key, compute))
+            # Avoid "exception was never retrieved" if every waiter went away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.shared += 1
+            status = "shared"
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), status
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+
+    async def _compute(self, key, compute):
+        try:
+            value = await compute()
+        finally:
+            if self.in_flight.get(key) is asyncio.current_task():
+                del self.in_flight[key]
+        self.store(key, value)
+        return value
+
+    def store(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "in_flight": len(self.in_flight),
+            "hit_ratio": (self.hits + self.shared) / lookups if lookups else 0.0,
+        }
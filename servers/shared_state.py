@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+
+# Tamanho máximo (bytes) do JSON de configuração compartilhado
+CONFIG_BLOB_SIZE = 64 * 1024
+
+def create_shared_context(shared_ctx, workers, max_backends, config, metrics_size=0):
+    """
+    Cria no processo principal os objetos de memória compartilhada usados pelos
+    workers do load balancer. Deve ser chamada em main_process_start do Sanic.
+
+    :param shared_ctx: app.shared_ctx do Sanic
+    :param workers: Número de workers (linhas da matriz de requisições em andamento)
+    :param max_backends: Número máximo de servidores configuráveis
+    :param config: Configuração inicial (dict serializável em JSON)
+    :param metrics_size: Valores por worker das métricas de /metrics (ver metrics.py)
+    """
+    shared_ctx.lb_config_lock = multiprocessing.Lock()
+    shared_ctx.lb_config_version = multiprocessing.RawValue("Q", 0)
+    shared_ctx.lb_config_blob = multiprocessing.RawArray("c", CONFIG_BLOB_SIZE)
+    shared_ctx.lb_config_blob.value = encode_config(config)
+    shared_ctx.lb_worker_counter = multiprocessing.RawValue("i", 0)
+    shared_ctx.lb_in_flight = multiprocessing.RawArray("q", workers * max_backends)
+    shared_ctx.lb_work_in_flight = multiprocessing.RawArray("d", workers * max_backends)
+    shared_ctx.lb_work_dispatched = multiprocessing.RawArray("d", workers * max_backends)
+    shared_ctx.lb_wrr_lock = multiprocessing.Lock()
+    shared_ctx.lb_wrr_weights = multiprocessing.RawArray("d", max_backends)
+    shared_ctx.lb_metrics = multiprocessing.RawArray("d", max(1, workers * metrics_size))
+
+def encode_config(config):
+    data = json.dumps(config).encode()
+    if len(data) >= CONFIG_BLOB_SIZE:
+        raise ValueError(f"Configuração excede {CONFIG_BLOB_SIZE} bytes")
+    return data
+
+class SharedBackendState:
+    """
+    Visão de um worker sobre o estado compartilhado do load balancer.
+
+    - Configuração: JSON + número de versão. Quem recebe um POST em /admin/config
+      grava a nova versão; os demais workers comparam a versão a cada requisição
+      (leitura sem lock) e recarregam quando ela muda.
+    - Requisições em andamento: matriz workers x servidores. Cada worker escreve
+      apenas na sua linha, sem lock, e o total de um servidor é a soma da coluna.
+      A leitura pode estar atrasada em no máximo as requisições que estão
+      começando ou terminando naquele instante em outros workers. O trabalho
+      estimado em andamento e o total despachado seguem o mesmo esquema.
+    - Métricas: uma linha de valores por worker, escrita só por ele (ver
+      metrics.py); ao contrário das requisições em andamento, nunca é zerada.
+    - Round robin ponderado: os pesos correntes ficam num único vetor protegido
+      por lock, então a sequência de escolhas é global entre os workers.
+    """
+
+    def __init__(self, shared_ctx, workers, max_backends):
+        self.ctx = shared_ctx
+        self.workers = workers
+        self.max_backends = max_backends
+        self.wrr_lock = shared_ctx.lb_wrr_lock
+        self.wrr_weights = shared_ctx.lb_wrr_weights
+        self.in_flight = shared_ctx.lb_in_flight
+        self.work_in_flight = shared_ctx.lb_work_in_flight
+        self.work_dispatched = shared_ctx.lb_work_dispatched
+        self.metrics = shared_ctx.lb_metrics
+        with shared_ctx.lb_config_lock:
+            self.worker_slot = shared_ctx.lb_worker_counter.value % workers
+            shared_ctx.lb_worker_counter.value += 1
+        self.row_offset = self.worker_slot * max_backends
+        self.clear_row()
+
+    def version(self):
+        return self.ctx.lb_config_version.value
+
+    def read_config(self):
+        """Retorna (versão, configuração) lidos de forma consistente."""
+        with self.ctx.lb_config_lock:
+            return self.ctx.lb_config_version.value, json.loads(self.ctx.lb_config_blob.value)
+
+    def publish_config(self, config, old_slots, new_slots):
+        """
+        Grava uma nova configuração para todos os workers e remapeia os pesos do
+        round robin. Os pesos só são preservados se o conjunto de servidores
+        ativos não mudou.
+
+        :param old_slots: {chave do servidor: slot} dos servidores ativos antes da mudança
+        :param new_slots: {chave do servidor: slot} dos servidores ativos depois da mudança
+        :return: Nova versão da configuração
+        """
+        data = encode_config(config)
+        with self.wrr_lock:
+            if set(old_slots) == set(new_slots):
+                previous = {key: self.wrr_weights[slot] for key, slot in old_slots.items()}
+            else:
+                previous = {}
+            for slot in range(self.max_backends):
+                self.wrr_weights[slot] = 0.0
+            for key, slot in new_slots.items():
+                self.wrr_weights[slot] = previous.get(key, 0.0)
+        with self.ctx.lb_config_lock:
+            self.ctx.lb_config_blob.value = data
+            self.ctx.lb_config_version.value += 1
+            return self.ctx.lb_config_version.value
+
+    def clear_row(self):
+        for slot in range(self.max_backends):
+            self.in_flight[self.row_offset + slot] = 0
+            self.work_in_flight[self.row_offset + slot] = 0.0
+            self.work_dispatched[self.row_offset + slot] = 0.0
+
+    def set_in_flight(self, slot, count):
+        self.in_flight[self.row_offset + slot] = count
+
+    def set_work(self, slot, in_flight, dispatched):
+        self.work_in_flight[self.row_offset + slot] = in_flight
+        self.work_dispatched[self.row_offset + slot] = dispatched
+
+    def total_in_flight(self, slot):
+        in_flight = self.in_flight
+        return sum(in_flight[row * self.max_backends + slot] for row in range(self.workers))
+
+    def total_work_in_flight(self, slot):
+        work = self.work_in_flight
+        return sum(work[row * self.max_backends + slot] for row in range(self.workers))
+
+    def total_work_dispatched(self, slot):
+        work = self.work_dispatched
+        return sum(work[row * self.max_backends + slot] for row in range(self.workers))
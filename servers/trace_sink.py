@@ -0,0 +1,83 @@
+"""
+Per-request timing traces shared by the load balancer and the hashing server.
+
+Every hop reads the trace ID from the X-Trace-Id header (creating one if the
+client did not send it), measures its own phases with time.monotonic() so no
+clock has to agree with another machine's, and reports them in two places:
+
+- a Server-Timing response header (durations in ms), which the load balancer
+  extends with its own phases, so the client sees the whole breakdown;
+- a TraceSink, which buffers one JSON record per request in memory and
+  appends them to a per-process file in batches, so tracing costs a dict
+  append per request and one write per batch.
+
+Records from every hop can be joined on "trace_id" afterwards.
+"""
+import json
+import os
+import time
+
+TRACE_HEADER = "x-trace-id"
+# Longer incoming IDs are cut, so a client can't make us log arbitrary data
+MAX_TRACE_ID_LENGTH = 64
+
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+
+def trace_id_from(headers):
+    trace_id = headers.get(TRACE_HEADER)
+    return trace_id[:MAX_TRACE_ID_LENGTH] if trace_id else new_trace_id()
+
+
+def server_timing(durations, prefix=""):
+    """Format {"name": seconds} as a Server-Timing header value in ms."""
+    return ", ".join(f"{prefix}{name};dur={seconds * 1000:.3f}" for name, seconds in durations.items())
+
+
+class TraceSink:
+    """
+    Buffered JSON-lines writer for trace records.
+
+    Records are written when flush_records of them are buffered or when a
+    record arrives more than flush_interval seconds after the last write.
+    """
+
+    def __init__(self, path, flush_records=512, flush_interval=1.0):
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.file = open(path, "a")
+
+    def record(self, **fields):
+        self.buffer.append(fields)
+        if len(self.buffer) >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        self.file.write("".join(json.dumps(record) + "\n" for record in self.buffer))
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def open_sink(prefix, hop):
+    """
+    Open this process's sink as <prefix>-<hop>-<pid>.jsonl, or return None when
+    prefix is empty (tracing to file disabled; headers are still returned).
+    """
+    if not prefix:
+        return None
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return TraceSink(f"{prefix}-{hop}-{os.getpid()}.jsonl")